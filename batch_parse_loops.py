@@ -0,0 +1,146 @@
+"""
+Non interactive version of parse_loop.py for building a loop library.
+
+Analyzes every audio file in the given directories/globs across a pool of processes,
+saves each one as a *_LOOP.loop file, and writes a summary report (.csv or .json).
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import time
+import numpy as np
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from utils.audio_loop import AudioLoop
+from utils.beat_cache import BeatCache
+
+
+AUDIO_EXTENSIONS = {".wav", ".flac", ".aiff", ".aif", ".ogg", ".mp3"}
+
+
+def parse_args():
+    """
+    Parses command line arguments.
+    Args: inputs, output-dir, jobs, report, tempo, hop, no-align, cache-dir, no-cache
+    """
+    parser = argparse.ArgumentParser(description="Analyze and save AudioLoop files for many audio files in parallel")
+    parser.add_argument("inputs", type=str, nargs="+", help="audio files, directories or globs to process")
+    parser.add_argument("-o", "--output-dir", type=str, default=".", help="directory to save the loop files to")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("-r", "--report", type=str, default="loop_report.csv", help="summary report (.csv or .json)")
+    parser.add_argument("-t", "--tempo", type=int, default=120, help="estimated tempo of the audio files")
+    parser.add_argument("--hop", type=int, default=512, help="beat detection hop length")
+    parser.add_argument("--no-align", action="store_true", help="don't align beats to the beginning of the audio")
+    parser.add_argument("--cache-dir", type=str, default=None, help="beat analysis cache directory")
+    parser.add_argument("--no-cache", action="store_true", help="always rerun the beat analysis")
+    return parser.parse_args()
+
+
+def find_audio_files(inputs) -> list:
+    files = []
+    for pattern in inputs:
+        path = Path(pattern)
+        if path.is_dir():
+            matches = [p for p in path.iterdir() if p.suffix.lower() in AUDIO_EXTENSIONS]
+        else:
+            matches = [Path(p) for p in glob.glob(pattern, recursive=True)]
+        files.extend(sorted(p.resolve() for p in matches if p.is_file()))
+
+    # remove duplicates but keep the order
+    return list(dict.fromkeys(files))
+
+
+def output_paths(files, output_dir) -> list:
+    """
+    Loop file for every audio file. Files with the same name from different directories would overwrite each other,
+    so those get their parent directory added to the name, or a hash of their path if that's the same too.
+    """
+    stems = Counter(f.stem for f in files)
+    names = [f"{f.stem}_{f.parent.name}" if stems[f.stem] > 1 else f.stem for f in files]
+    taken = Counter(names)
+    names = [f"{f.stem}_{hashlib.sha1(str(f).encode()).hexdigest()[:8]}" if taken[name] > 1 else name
+             for f, name in zip(files, names)]
+    return [Path(output_dir) / f"{name}_LOOP.loop" for name in names]
+
+
+def analyze(filepath, output, hop_length, estimated_bpm, align_beats_to_start, cache_dir, use_cache) -> dict:
+    """WORKER: analyze one file and save it as a loop file"""
+    start = time.perf_counter()
+    result = {"file": str(filepath)}
+    try:
+        cache = None
+        if use_cache:
+            cache = BeatCache() if cache_dir is None else BeatCache(cache_dir)
+
+        loop = AudioLoop(path=filepath, hop_length=hop_length, estimated_bpm=estimated_bpm,
+                         align_beats_to_start=align_beats_to_start, cache=cache)
+
+        loop.save(output)
+
+        result.update({
+            "output": str(output),
+            "tempo": float(np.squeeze(loop.tempo)),
+            "beats": int(loop.beat_frames.shape[0]),
+            "adjusted_samples": int(loop.num_frames_adjusted * loop.hop_length),
+            "error": "",
+        })
+    except Exception as e:
+        result.update({"output": "", "tempo": None, "beats": None, "adjusted_samples": None,
+                       "error": type(e).__name__ + ': ' + str(e)})
+
+    result["analysis_time"] = time.perf_counter() - start
+    return result
+
+
+def write_report(filename, results):
+    if Path(filename).suffix == ".json":
+        with open(filename, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        with open(filename, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["file", "output", "tempo", "beats", "adjusted_samples",
+                                                   "analysis_time", "error"])
+            writer.writeheader()
+            writer.writerows(results)
+
+
+def main():
+    args = parse_args()
+    files = find_audio_files(args.inputs)
+    if len(files) == 0:
+        raise FileNotFoundError("no audio files found")
+
+    Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+    print(f"Analyzing {len(files)} files with {args.jobs} workers")
+
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(analyze, filepath, output, args.hop, args.tempo, not args.no_align,
+                               args.cache_dir, not args.no_cache)
+                   for filepath, output in zip(files, output_paths(files, args.output_dir))]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result["error"]:
+                print(f"FAILED {Path(result['file']).name}: {result['error']}")
+            else:
+                print(f"{Path(result['file']).name}: tempo {result['tempo']:.2f}, {result['beats']} beats, "
+                      f"adjusted {result['adjusted_samples']} samples ({result['analysis_time']:.2f} s)")
+
+    # report in the same order as the inputs
+    order = {str(f): i for i, f in enumerate(files)}
+    results.sort(key=lambda r: order[r["file"]])
+    write_report(args.report, results)
+
+    failed = sum(1 for r in results if r["error"])
+    print(f"Analyzed {len(results) - failed}/{len(results)} files in {time.perf_counter() - start:.2f} s")
+    print(f"Saved report to {args.report}")
+
+
+if __name__ == '__main__':
+    main()
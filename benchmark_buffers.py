@@ -0,0 +1,167 @@
+"""
+Benchmarks the buffer and loop primitives used in the audio callbacks and stretch path.
+
+Measures per block latency percentiles and throughput for several block sizes and channel counts.
+Save a baseline with --save-baseline, then run with --baseline to fail (exit code 1)
+when the p50 of a case got slower than the baseline by more than --tolerance and --floor-us.
+Every case is run --repeats times and the fastest run is kept.
+"""
+import argparse
+import sys
+import numpy as np
+from utils.audio_loop import AudioLoop
+from utils.circular_buffer import CircularBuffer
+from utils.queue_buffer import QueueBuffer, LockFreeQueueBuffer
+from utils.benchmark import time_calls, summarize, best_of, print_results, save_baseline, load_baseline, \
+    find_regressions
+
+
+BLOCK_SIZES = [64, 128, 256, 512, 1024, 2048, 4096, 8192]
+CHANNELS = [1, 2, 8]
+
+
+def parse_args():
+    """
+    Parses command line arguments.
+    Args: baseline, save-baseline, tolerance, floor-us, repeats, iterations
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the buffer and loop primitives")
+    parser.add_argument("--baseline", default=None, help="json baseline to compare against")
+    parser.add_argument("--save-baseline", default=None, help="save the results as a json baseline to this file")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed fractional slowdown of p50")
+    parser.add_argument("--floor-us", type=float, default=2.0,
+                        help="p50 slowdowns of at most this many microseconds are never regressions")
+    parser.add_argument("-r", "--repeats", type=int, default=3,
+                        help="runs of every case, the fastest of which is kept")
+    parser.add_argument("-n", "--iterations", type=int, default=2000, help="timed calls per case")
+    parser.add_argument("-b", "--block-sizes", type=int, nargs="+", default=BLOCK_SIZES, help="block sizes to test")
+    parser.add_argument("-c", "--channels", type=int, nargs="+", default=CHANNELS, help="channel counts to test")
+    return parser.parse_args()
+
+
+def make_loop(channels, sample_rate=44100, seconds=4, tempo=120.0, hop_length=512) -> AudioLoop:
+    """Synthetic AudioLoop so no audio file or beat analysis is needed"""
+    samples = sample_rate * seconds
+    samples_per_beat = sample_rate * 60 / tempo
+    beat_frames = np.rint(np.arange(0, samples, samples_per_beat) / hop_length).astype(int)
+    return AudioLoop(data={
+        "audio": np.random.uniform(-1, 1, (samples, channels)).astype(np.float32),
+        "sample_rate": sample_rate,
+        "beat_frames": beat_frames,
+        "tempo": tempo,
+        "block_size": 1024,
+        "hop_length": hop_length,
+        "samples": samples,
+        "channels": channels,
+        "num_frames_adjusted": 0
+    })
+
+
+def bench_circular_buffer(block_size, channels, iterations) -> dict:
+    buffer = CircularBuffer((4 * block_size + 3, channels))  # odd size so the indices wrap around
+    block = np.random.uniform(-1, 1, (block_size, channels))
+    output = np.zeros((block_size, channels))
+    idx = 0
+    scratch = np.zeros((block_size, channels))
+
+    def put():
+        nonlocal idx
+        idx = buffer.put(idx, block)
+
+    def get_into():
+        nonlocal idx
+        idx = buffer.get_into(idx, output)
+
+    def get_view():
+        nonlocal idx
+        idx, _ = buffer.get_view(idx, block_size, scratch=scratch)
+
+    return {
+        "CircularBuffer.put": time_calls(put, iterations),
+        "CircularBuffer.get_into": time_calls(get_into, iterations),
+        "CircularBuffer.get_view": time_calls(get_view, iterations),
+    }
+
+
+def bench_queue_buffer(cls, block_size, channels, iterations) -> dict:
+    queue = cls((4 * block_size, channels))
+    block = np.random.uniform(-1, 1, (block_size, channels))
+    output = np.zeros((block_size, channels))
+
+    def drain():
+        # keep room in the queue without timing the reader
+        if queue.size() > 2 * block_size:
+            queue.get_into_nowait(output)
+
+    def fill():
+        # keep data in the queue without timing the writer
+        if queue.size() < block_size:
+            queue.put_nowait(block)
+
+    def write_regions():
+        # write a block straight into the free space, like the loop output path
+        for region in queue.write_regions(block_size):
+            region[:] = 0.5
+        queue.commit_write(block_size)
+
+    name = cls.__name__
+    return {
+        f"{name}.write_regions": time_calls(write_regions, iterations, setup=drain),
+        f"{name}.put": time_calls(lambda: queue.put(block), iterations, setup=drain),
+        f"{name}.put_incrementally": time_calls(lambda: queue.put(block, put_incrementally=True),
+                                                iterations, setup=drain),
+        f"{name}.get_into_nowait": time_calls(lambda: queue.get_into_nowait(output), iterations, setup=fill),
+    }
+
+
+def bench_audio_loop(block_size, channels, iterations) -> dict:
+    loop = make_loop(channels)
+    mirrored_loop = make_loop(channels)
+    mirrored_loop.use_mirrored_buffer(block_size)
+
+    return {
+        "AudioLoop.get_next_block": time_calls(lambda: loop.get_next_block(block_size), iterations),
+        "AudioLoop.get_next_block_view": time_calls(lambda: loop.get_next_block_view(block_size), iterations),
+        "AudioLoop.get_next_block_view(mirrored)": time_calls(lambda: mirrored_loop.get_next_block_view(block_size),
+                                                              iterations),
+    }
+
+
+def main():
+    args = parse_args()
+
+    # the fastest of a few runs -> a busy moment on the machine doesn't end up in the results
+    runs = {}
+    for _ in range(args.repeats):
+        for channels in args.channels:
+            for block_size in args.block_sizes:
+                cases = {}
+                cases.update(bench_circular_buffer(block_size, channels, args.iterations))
+                cases.update(bench_queue_buffer(QueueBuffer, block_size, channels, args.iterations))
+                cases.update(bench_queue_buffer(LockFreeQueueBuffer, block_size, channels, args.iterations))
+                cases.update(bench_audio_loop(block_size, channels, args.iterations))
+
+                for name, times in cases.items():
+                    runs.setdefault(f"{name} b={block_size} c={channels}", []).append(summarize(times, block_size))
+    results = {name: best_of(summaries) for name, summaries in runs.items()}
+
+    print_results(results)
+
+    if args.save_baseline is not None:
+        save_baseline(args.save_baseline, results)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.baseline is not None:
+        # p99 and max are printed for information only
+        regressions = find_regressions(results, load_baseline(args.baseline), tolerance=args.tolerance,
+                                       keys=("p50_us",), floor=args.floor_us)
+        if regressions:
+            print(f"{len(regressions)} regressions found:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions found")
+
+
+if __name__ == "__main__":
+    main()
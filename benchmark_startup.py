@@ -0,0 +1,112 @@
+"""
+Benchmarks the startup time of main.py up to its first stretched audio block.
+
+Each run is a fresh python process that imports main.py, loads the given loop file,
+creates the stretcher and stretches the first block. The time of each stage and whether
+librosa got imported along the way are printed. Like benchmark_buffers.py, this can save
+a baseline and fail when startup gets slower than it.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+import numpy as np
+from pathlib import Path
+from utils.benchmark import save_baseline, load_baseline, find_regressions
+from utils.stretcher import STRETCHERS
+
+
+# runs in a fresh interpreter so nothing is already imported
+CHILD_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+stages = {}
+
+import main
+from utils.stretcher import create_stretcher
+stages["import_main"] = time.perf_counter() - start
+
+from utils.audio_loop import AudioLoop
+loop = AudioLoop.from_file(sys.argv[1])
+stages["load_loop"] = time.perf_counter() - start
+
+block_size = int(sys.argv[2])
+loop.use_mirrored_buffer(block_size)
+stretcher = create_stretcher(sys.argv[3], sample_rate=loop.sample_rate, channels=loop.channels)
+stretcher.process(loop.get_next_block_view(block_size), False)
+stretched = stretcher.retrieve()
+stages["first_block"] = time.perf_counter() - start
+
+try:
+    import sounddevice
+    stages["import_sounddevice"] = time.perf_counter() - start
+except (ImportError, OSError):
+    pass
+
+print(json.dumps({"stages": stages, "librosa_loaded": "librosa" in sys.modules}))
+"""
+
+
+def parse_args():
+    """
+    Parses command line arguments.
+    Args: loop, runs, block-size, stretcher, baseline, save-baseline, tolerance
+    """
+    parser = argparse.ArgumentParser(description="Benchmark main.py startup time to the first audio block")
+    parser.add_argument("-l", "--loop", required=True, help="*.loop file containing AudioLoop object")
+    parser.add_argument("-n", "--runs", type=int, default=5, help="number of fresh processes to time")
+    parser.add_argument("-b", "--block-size", type=int, default=1024, help="audio block size in frames")
+    parser.add_argument("-s", "--stretcher", choices=STRETCHERS, default="auto", help="time stretch backend")
+    parser.add_argument("--baseline", default=None, help="json baseline to compare against")
+    parser.add_argument("--save-baseline", default=None, help="save the results as a json baseline to this file")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed fractional slowdown of the median")
+    return parser.parse_args()
+
+
+def run_once(loop_file, block_size, stretcher) -> dict:
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD_SCRIPT, str(loop_file), str(block_size), stretcher],
+                            cwd=Path(__file__).resolve().parent, capture_output=True, text=True, check=True)
+    total = time.perf_counter() - start
+
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    result["stages"]["process_total"] = total
+    return result
+
+
+def main():
+    args = parse_args()
+    loop_file = Path(args.loop).resolve()
+    if not loop_file.exists():
+        raise FileNotFoundError()
+
+    runs = [run_once(loop_file, args.block_size, args.stretcher) for _ in range(args.runs)]
+
+    results = {}
+    print(f"{'stage (seconds since interpreter start)':<44}{'p50 ms':>10}{'max ms':>10}")
+    for stage in runs[0]["stages"]:
+        times = np.array([run["stages"][stage] for run in runs]) * 1e3
+        results[f"startup.{stage}"] = {"p50_us": float(np.median(times) * 1e3), "max_us": float(np.max(times) * 1e3)}
+        print(f"{stage:<44}{np.median(times):>10.1f}{np.max(times):>10.1f}")
+
+    librosa_loaded = any(run["librosa_loaded"] for run in runs)
+    print(f"librosa imported: {librosa_loaded}")
+
+    if args.save_baseline is not None:
+        save_baseline(args.save_baseline, results)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.baseline is not None:
+        regressions = find_regressions(results, load_baseline(args.baseline), tolerance=args.tolerance,
+                                       keys=("p50_us",))
+        if regressions:
+            print(f"{len(regressions)} regressions found:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions found")
+
+
+if __name__ == "__main__":
+    main()
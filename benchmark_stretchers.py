@@ -0,0 +1,165 @@
+"""
+Benchmarks the time stretch backends against each other at several time ratios.
+
+For every backend and ratio this prints the CPU time per second of input audio, the latency the
+stretcher reports (get_latency), how far the output length is off the ratio, the pitch error of a
+440 Hz tone in cents and the log spectral distance between the input and output (dB). The audio is
+the given loop file or a synthetic mix of tones and drum hits. Like benchmark_buffers.py, this can
+save a baseline and fail when a backend gets slower than it.
+"""
+import argparse
+import sys
+import time
+import numpy as np
+from utils.audio_loop import AudioLoop
+from utils.stretcher import create_stretcher
+from utils.benchmark import save_baseline, load_baseline, find_regressions
+
+
+RATIOS = [0.5, 0.8, 1.0, 1.25, 1.5, 2.0]
+
+
+def parse_args():
+    """
+    Parses command line arguments.
+    Args: loop, stretchers, ratios, block-size, seconds, baseline, save-baseline, tolerance
+    """
+    parser = argparse.ArgumentParser(description="Benchmark CPU, latency and quality of the time stretch backends")
+    parser.add_argument("-l", "--loop", default=None, help="*.loop file to stretch (default synthetic audio)")
+    parser.add_argument("-s", "--stretchers", nargs="+", default=["rubberband", "wsola"], help="backends to test")
+    parser.add_argument("-r", "--ratios", type=float, nargs="+", default=RATIOS, help="time ratios to test")
+    parser.add_argument("-b", "--block-size", type=int, default=1024, help="audio block size in frames")
+    parser.add_argument("--seconds", type=float, default=10.0, help="seconds of audio to stretch per case")
+    parser.add_argument("--baseline", default=None, help="json baseline to compare against")
+    parser.add_argument("--save-baseline", default=None, help="save the results as a json baseline to this file")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed fractional increase of cpu per second")
+    return parser.parse_args()
+
+
+def make_audio(sample_rate, seconds, channels=2, tempo=120.0) -> np.ndarray:
+    """Tones with a decaying noise burst on every beat -> both tonal and transient content"""
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    audio = 0.2 * (np.sin(2 * np.pi * 220 * t) + np.sin(2 * np.pi * 330 * t) + np.sin(2 * np.pi * 440 * t))
+
+    beat_length = int(sample_rate * 60 / tempo)
+    hit = np.random.default_rng(0).uniform(-1, 1, beat_length // 4) * np.exp(-np.arange(beat_length // 4) / 500)
+    for start in range(0, t.shape[0] - hit.shape[0], beat_length):
+        audio[start:start + hit.shape[0]] += 0.5 * hit
+
+    return np.repeat(audio[:, np.newaxis], channels, axis=1).astype(np.float32)
+
+
+def make_tone(sample_rate, seconds, channels=2, frequency=440.0) -> np.ndarray:
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    tone = 0.5 * np.sin(2 * np.pi * frequency * t)
+    return np.repeat(tone[:, np.newaxis], channels, axis=1).astype(np.float32)
+
+
+def stretch(name, audio, sample_rate, ratio, block_size):
+    """Stretch all of audio in blocks. Returns the output, cpu seconds and the reported latency"""
+    stretcher = create_stretcher(name, sample_rate=sample_rate, channels=audio.shape[1])
+    stretcher.set_time_ratio(ratio)
+
+    outputs = []
+    latency = 0
+    start = time.process_time()
+    for i in range(0, audio.shape[0], block_size):
+        final = i + block_size >= audio.shape[0]
+        stretcher.process(audio[i:i + block_size], final)
+        stretched = stretcher.retrieve()
+        while stretched.shape[0] > 0:
+            outputs.append(stretched)
+            stretched = stretcher.retrieve()
+        if not final:
+            latency = max(latency, stretcher.get_latency())
+    cpu = time.process_time() - start
+
+    output = np.concatenate(outputs) if outputs else np.zeros((0, audio.shape[1]), dtype=np.float32)
+    return output, cpu, latency
+
+
+def average_spectrum(audio: np.ndarray, frame_size=4096) -> np.ndarray:
+    """Mean magnitude spectrum of the mono audio over half overlapping frames"""
+    mono = audio.mean(axis=1)
+    window = np.hanning(frame_size)
+    starts = range(0, mono.shape[0] - frame_size, frame_size // 2)
+    return np.mean([np.abs(np.fft.rfft(mono[s:s + frame_size] * window)) for s in starts], axis=0)
+
+
+def spectral_distance(audio: np.ndarray, stretched: np.ndarray) -> float:
+    """RMS difference in dB of the average spectra -> stretching should leave it unchanged"""
+    reference = 20 * np.log10(average_spectrum(audio) + 1e-9)
+    result = 20 * np.log10(average_spectrum(stretched) + 1e-9)
+    # only compare bins that aren't silent in the input
+    mask = reference > reference.max() - 60
+    return float(np.sqrt(np.mean(np.square(result[mask] - reference[mask]))))
+
+
+def pitch_error(stretched: np.ndarray, sample_rate, frequency=440.0) -> float:
+    """Error in cents of the strongest frequency of the stretched tone"""
+    mono = stretched.mean(axis=1)
+    padded = mono.shape[0] * 4  # zero pad for finer frequency bins
+    spectrum = np.abs(np.fft.rfft(mono * np.hanning(mono.shape[0]), n=padded))
+    peak = np.argmax(spectrum) * sample_rate / padded
+    return float(1200 * np.log2(peak / frequency))
+
+
+def bench_stretcher(name, audio, tone, sample_rate, ratio, block_size) -> dict:
+    seconds = audio.shape[0] / sample_rate
+    stretched, cpu, latency = stretch(name, audio, sample_rate, ratio, block_size)
+    stretched_tone, _, _ = stretch(name, tone, sample_rate, ratio, block_size)
+
+    return {
+        "cpu_per_sec": cpu / seconds,
+        "latency": int(latency),
+        "length_error": stretched.shape[0] / (audio.shape[0] * ratio) - 1,
+        "pitch_cents": pitch_error(stretched_tone, sample_rate),
+        "spectral_db": spectral_distance(audio, stretched),
+    }
+
+
+def main():
+    args = parse_args()
+
+    if args.loop is not None:
+        loop = AudioLoop.from_file(args.loop)
+        sample_rate = loop.sample_rate
+        repeats = int(np.ceil(args.seconds * sample_rate / loop.samples))
+        audio = np.tile(np.asarray(loop.audio, dtype=np.float32), (repeats, 1))[:int(args.seconds * sample_rate)]
+    else:
+        sample_rate = 44100
+        audio = make_audio(sample_rate, args.seconds)
+    tone = make_tone(sample_rate, min(args.seconds, 4.0), channels=audio.shape[1])
+
+    results = {}
+    print(f"{'case':<28}{'cpu ms/s':>10}{'latency':>10}{'length %':>10}{'cents':>10}{'spec dB':>10}")
+    for name in args.stretchers:
+        for ratio in args.ratios:
+            try:
+                stats = bench_stretcher(name, audio, tone, sample_rate, ratio, args.block_size)
+            except ImportError as e:
+                print(f"skipping {name}: {e}")
+                break
+
+            case = f"stretch.{name}.{ratio:g}"
+            results[case] = stats
+            print(f"{case:<28}{stats['cpu_per_sec'] * 1e3:>10.2f}{stats['latency']:>10d}"
+                  f"{stats['length_error'] * 100:>10.2f}{stats['pitch_cents']:>10.1f}{stats['spectral_db']:>10.2f}")
+
+    if args.save_baseline is not None:
+        save_baseline(args.save_baseline, results)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.baseline is not None:
+        regressions = find_regressions(results, load_baseline(args.baseline), tolerance=args.tolerance,
+                                       keys=("cpu_per_sec",))
+        if regressions:
+            print(f"{len(regressions)} regressions found:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions found")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Measures the latency profile used by main.py's beat sync (see utils/latency.py).
+
+A click track is played on the output and recorded on the input (use a loopback cable or hold
+the mic to the speaker). The round trip delay of the clicks is compared to the latency the streams
+report, and the recording is run through the BeatDetector to measure how late it timestamps beats.
+Without audio devices, pass a recording of the click track (from --write-clicks) with --recording.
+The result is saved as json for main.py --latency-profile.
+"""
+import argparse
+import soundfile as sf
+from utils.latency import LatencyBudget, make_click_track, measure_round_trip, measure_detection_delay
+
+
+def parse_args():
+    """
+    Parses command line arguments.
+    Args: output-file, input, output, recording, write-clicks, block-size, hop, analysis-rate, tempo, seconds
+    """
+    parser = argparse.ArgumentParser(description="Measure the round trip and beat detection latency")
+    parser.add_argument("profile", help="json file to save the latency profile to")
+    parser.add_argument("-i", "--input", type=int, default=None, help="input device #")
+    parser.add_argument("-o", "--output", type=int, default=None, help="output device #")
+    parser.add_argument("--recording", default=None,
+                        help="recording of the click track to analyze instead of using the audio devices")
+    parser.add_argument("--write-clicks", default=None, help="write the click track to this wav file and exit")
+    parser.add_argument("-b", "--block-size", type=int, default=1024, help="audio block size in frames")
+    parser.add_argument("--hop", type=int, default=None, help="beat tracking hop size (as in main.py)")
+    parser.add_argument("--analysis-rate", type=int, default=None, help="beat tracking sample rate (as in main.py)")
+    parser.add_argument("-t", "--tempo", type=float, default=120.0, help="tempo of the click track")
+    parser.add_argument("--seconds", type=float, default=20.0, help="length of the click track")
+    parser.add_argument("--max-delay", type=float, default=1.0, help="largest round trip in seconds to look for")
+    return parser.parse_args()
+
+
+def record(track, sample_rate, args):
+    """Play the click track and record it. Returns the mono recording and the reported (input, output) latency"""
+    import sounddevice as sd
+
+    recording = sd.playrec(track, samplerate=sample_rate, channels=1, device=(args.input, args.output),
+                           blocksize=args.block_size, latency='low', dtype="float32")
+    sd.wait()
+    input_latency, output_latency = sd.get_stream().latency
+    return recording[:, 0], input_latency, output_latency
+
+
+def main():
+    args = parse_args()
+    sample_rate = 44100
+
+    if args.recording is not None:
+        sample_rate = sf.info(args.recording).samplerate
+    track, clicks = make_click_track(sample_rate, args.seconds, tempo=args.tempo)
+
+    if args.write_clicks is not None:
+        sf.write(args.write_clicks, track, sample_rate)
+        print(f"Wrote {clicks.shape[0]} clicks to {args.write_clicks}")
+        return
+
+    if args.recording is not None:
+        # a file has no reported latency -> main.py takes the stream latency out of the round trip
+        recording, _ = sf.read(args.recording, dtype="float32", always_2d=True)
+        recording = recording.mean(axis=1)
+        input_latency, output_latency = 0.0, 0.0
+    else:
+        recording, input_latency, output_latency = record(track, sample_rate, args)
+
+    round_trip = measure_round_trip(recording, track, int(args.max_delay * sample_rate))
+    detection = measure_detection_delay(recording, sample_rate, clicks + round_trip, tempo=args.tempo,
+                                        block_size=args.block_size, hop_size=args.hop,
+                                        analysis_rate=args.analysis_rate)
+
+    budget = LatencyBudget(input=input_latency, output=output_latency, detection=detection / sample_rate,
+                           round_trip=round_trip / sample_rate)
+    print(f"{'measured round trip':<22}{round_trip / sample_rate * 1e3:>8.2f} ms")
+    budget.print_stages()
+
+    budget.save(args.profile, sample_rate=sample_rate,
+                block_size=args.block_size, hop_size=args.hop, analysis_rate=args.analysis_rate)
+    print(f"Saved latency profile to {args.profile}")
+
+
+if __name__ == "__main__":
+    main()
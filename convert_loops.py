@@ -0,0 +1,40 @@
+"""
+Converts old pickled AudioLoop files (*_LOOP.pkl) into the binary loop file format,
+which can be memory mapped and is safe to load.
+"""
+import argparse
+from pathlib import Path
+from utils.audio_loop import AudioLoop
+
+
+def parse_args():
+    """
+    Parses command line arguments.
+    Args: files, overwrite
+    """
+    parser = argparse.ArgumentParser(description="Convert pickled *_LOOP.pkl files to *_LOOP.loop files")
+    parser.add_argument("files", type=str, nargs="+", help="*.pkl files to convert")
+    parser.add_argument("--overwrite", action="store_true", help="overwrite existing .loop files")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    for filename in args.files:
+        filepath = Path(filename).resolve()
+        if not filepath.exists():
+            raise FileNotFoundError(filepath)
+
+        output = filepath.with_suffix(".loop")
+        if output.exists() and not args.overwrite:
+            print(f"Skipping {filepath.name}: {output.name} already exists")
+            continue
+
+        loop = AudioLoop.from_file(filepath, allow_pickle=True)
+        loop.save(output)
+        print(f"Converted {filepath.name} to {output.name}")
+
+
+if __name__ == '__main__':
+    main()
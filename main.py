@@ -1,19 +1,15 @@
 import argparse
 import numpy as np
-import sounddevice as sd
-import soundfile as sf
 from utils.audio_loop import AudioLoop
-from lib.btrack import BeatTracker  # pylint: disable=import-error,no-name-in-module
-import librosa
-import pickle
-import time
-from utils.circular_buffer import CircularBuffer
-from lib.rubberband import AudioStretcher  # pylint: disable=import-error,no-name-in-module
-from threading import Thread, Event
-from queue import Queue, Empty
-from utils.queue_buffer import QueueBuffer
-from utils.input_file_stream import InputFileStream
-from aubio import tempo as Tempo  # pylint: disable=no-name-in-module
+from threading import Thread
+from utils.queue_buffer import LockFreeQueueBuffer, AnalysisRing, JitterBuffer
+from utils.input_file_stream import InputFileStream, FILE_MODES
+from utils.beat_detector import BeatDetector
+from utils.beat_stream import StreamClock, BeatStream
+from utils.loop_engine import LoopEngine, mix_into
+from utils.instrumentation import Instrumentation
+from utils.stretcher import STRETCHERS
+from utils.latency import LatencyBudget
 
 
 def parse_args():
@@ -31,11 +27,43 @@ def parse_args():
     parser = argparse.ArgumentParser(
         description="???"
     )
-    parser.add_argument("-l", "--loop", required=True, help="*.pkl file containing AudioLoop object")
+    parser.add_argument("-l", "--loop", required=True, nargs="+",
+                        help="one or more *.loop files containing AudioLoop objects "
+                             "(convert old *.pkl files with convert_loops.py)")
+    parser.add_argument("-g", "--gain", type=float, nargs="+", default=None, help="gain of each loop (default 1.0)")
+    parser.add_argument("-w", "--stretch-workers", type=int, default=0,
+                        help="number of threads stretching the loops in parallel (0 stretches them serially)")
+    parser.add_argument("-s", "--stretcher", choices=STRETCHERS, default="auto",
+                        help="time stretch backend (auto uses rubberband if it is built, else wsola)")
+    parser.add_argument("--stretch-cache", type=float, default=0,
+                        help="MB per loop for pre rendering it at steady tempo ratios (0 always stretches live)")
+    parser.add_argument("--cache-step", type=float, default=0.005, help="time ratio step of the pre rendered loops")
     parser.add_argument("-i", "--input", type=int_or_str, default=None,
                         help="either input device # or file to stream as input")
+    parser.add_argument("--input-mode", choices=FILE_MODES, default="loop",
+                        help="at the end of an input file either loop back to its start or stop")
+    parser.add_argument("--input-start", type=float, default=0.0, help="seconds into the input file to start from")
     parser.add_argument("-o", "--output", type=int, default=None, help="output device #")
+    parser.add_argument("-d", "--duplex", action="store_true",
+                        help="use one full duplex stream for the input, its monitoring and the loops (input device only)")
+    parser.add_argument("--adaptive-buffers", action="store_true",
+                        help="adapt the input monitor and loop output buffering to the lowest latency the host sustains")
+    parser.add_argument("--max-latency", type=float, default=100.0,
+                        help="latency ceiling in ms of each adaptive buffer")
     parser.add_argument("-b", "--block-size", type=int, default=1024, help="audio block size in frames")
+    parser.add_argument("--hop", type=int, default=None,
+                        help="beat tracking hop size in frames, independent of the block size (default block size)")
+    parser.add_argument("--analysis-rate", type=int, default=None,
+                        help="decimate the input to about this sample rate before beat tracking (eg 44100 on 96 kHz)")
+    parser.add_argument("-r", "--render", default=None,
+                        help="render the input file and synced loop offline to this wav file instead of playing")
+    parser.add_argument("--loop-start", type=float, default=0.0,
+                        help="seconds into the input to start the loop when rendering offline")
+    parser.add_argument("--stats", default=None,
+                        help="record callback timing and periodically append it to this .json or .csv file")
+    parser.add_argument("--stats-interval", type=float, default=1.0, help="seconds between stats dumps")
+    parser.add_argument("--latency-profile", default=None,
+                        help="json latency profile measured by calibrate_latency.py to compensate the beat sync with")
 
     return parser.parse_args()
 
@@ -45,116 +73,195 @@ def main():
     args = parse_args()
     # block size
     block_size = args.block_size
-    hop_size = block_size
+    hop_size = block_size if args.hop is None else args.hop
     input_sample_rate = 44100
 
     # gain on input
     input_gain = 0.5
 
-    # load the Audio Loop object
-    loop = AudioLoop.from_file(args.loop)
+    # load the Audio Loop objects
+    loops = [AudioLoop.from_file(filename) for filename in args.loop]
 
-    # create the io buffers
-    input_buffer = QueueBuffer((4*block_size, 2))
-    loop_buffer = QueueBuffer((int(1 * block_size), loop.channels))
-    input_queue = Queue()
+    # offline rendering skips the audio devices entirely
+    if args.render is not None:
+        if not isinstance(args.input, str):
+            raise ValueError("--render requires an input file")
+        from utils.offline_render import render_offline
+        frames = render_offline(loops, args.input, args.render, block_size=block_size, input_gain=input_gain,
+                                loop_start=args.loop_start, gains=args.gain, stretch_workers=args.stretch_workers,
+                                hop_size=hop_size, analysis_rate=args.analysis_rate, stretcher=args.stretcher,
+                                stretch_cache=args.stretch_cache, cache_step=args.cache_step)
+        print(f"Rendered {frames} frames to {args.render}")
+        return
 
-    # Stream callbacks
-    def input_callback(indata, frames, *args, **kwargs):
-        input_buffer.put(indata * input_gain, frames)
-        input_queue.put_nowait(indata)  # TODO: need to copy??
+    # only import sounddevice when we actually need the audio devices
+    import sounddevice as sd
 
-    def output_callback(outdata, frames, *args, **kwargs):
+    # Stream callbacks
+    def input_callback(indata, frames, time_info=None, status=None):
+        start = input_monitor.start()
+        input_clock.update(frames, time_info)  # absolute sample index and stream time of this block
+        input_buffer.put_nowait(indata * input_gain, frames)
+        analysis_ring.write(indata, frames)  # copied, so it's fine that sounddevice reuses indata
+        input_monitor.stop(start, frames, status)
+
+    def output_callback(outdata, frames, time_info=None, status=None):
+        start = output_monitor.start()
         if not input_buffer.get_into_nowait(outdata, length=frames):
             outdata[:] = 0
+            output_monitor.underflow()
+        output_monitor.stop(start, frames, status)
 
-    def loop_output_callback(outdata, frames, *args, **kwargs):
+    def loop_output_callback(outdata, frames, time_info=None, status=None):
+        start = loop_output_monitor.start()
         if not loop_buffer.get_into_nowait(outdata, length=frames):
             outdata[:] = 0
+            loop_output_monitor.underflow()
+        loop_output_monitor.stop(start, frames, status)
+
+    def duplex_callback(indata, outdata, frames, time_info=None, status=None):
+        start = duplex_monitor.start()
+        input_clock.update(frames, time_info)
+        analysis_ring.write(indata, frames)
+
+        # monitor the input and mix in the loops in the same callback -> one clock and no input buffer
+        outdata[:] = 0
+        mix_into(outdata, indata, gain=input_gain, scratch=input_scratch)
+        if loop_output_started:
+            regions = loop_buffer.read_regions_nowait(frames)
+            if regions is None:
+                duplex_monitor.underflow()
+            else:
+                offset = 0
+                for region in regions:
+                    mix_into(outdata[offset:offset + region.shape[0]], region)
+                    offset += region.shape[0]
+                loop_buffer.commit_read(frames)
+        duplex_monitor.stop(start, frames, status)
 
     # select either input stream or file
-    if args.input is None or isinstance(args.input, int):
+    if args.duplex:
+        if isinstance(args.input, str):
+            raise ValueError("--duplex requires an input device, not a file")
+        input_stream = None  # created with the loop engine below
+    elif args.input is None or isinstance(args.input, int):
         input_stream = sd.InputStream(samplerate=input_sample_rate, blocksize=block_size,
                                       latency='low', device=args.input, dtype="float32", callback=input_callback)
     elif isinstance(args.input, str):
-        input_stream = InputFileStream(args.input, block_size=block_size, callback=input_callback)
+        input_stream = InputFileStream(args.input, block_size=block_size, callback=input_callback,
+                                       mode=args.input_mode, start=args.input_start)
         input_sample_rate = input_stream.sample_rate
     else:
         raise ValueError("Bad input argument")
     print(f"Input sample rate: {input_sample_rate}")
 
-    # output stream for the input stream
-    output_stream = sd.OutputStream(samplerate=input_sample_rate, blocksize=block_size, channels=input_stream.channels,
-                                    latency='low', device=args.output, callback=output_callback)
-
-    # output stream for the stretched loop
-    loop_output_stream = sd.OutputStream(samplerate=loop.sample_rate, blocksize=block_size, channels=loop.channels,
-                                         latency='low', device=args.output, callback=loop_output_callback)
+    # create the io buffers -> lock free so the stream callbacks never block
+    if args.duplex:
+        input_buffer = None  # the duplex callback monitors the input directly
+    elif args.adaptive_buffers:
+        # the input and output streams run on separate clocks -> the output pulls the fill level to the target
+        input_buffer = JitterBuffer((4 * block_size, 2), block_size, correct_drift=True,
+                                    max_target=int(args.max_latency / 1000 * input_sample_rate))
+    else:
+        input_buffer = LockFreeQueueBuffer((4 * block_size, 2))
+
+    # input callback is the clock for beat timestamps
+    input_clock = StreamClock(input_sample_rate)
+
+    # the loop engine stretches and mixes every loop into one output stream
+    engine = LoopEngine(loops, block_size, input_sample_rate, gains=args.gain, workers=args.stretch_workers,
+                        stretcher=args.stretcher, cache_bytes=int(args.stretch_cache * 2 ** 20),
+                        cache_step=args.cache_step)
+    # the loops are mixed straight into this -> room for the block being played and the next one.
+    # the main loop is woken by the loop output once it gets down to its low watermark, so only as much
+    # stretched audio is queued as the output needs and new time scales are heard as soon as possible
+    if args.adaptive_buffers:
+        # the low watermark follows the lowest latency the loop output sustains
+        loop_buffer = JitterBuffer((2 * block_size, engine.channels), block_size,
+                                   max_target=int(args.max_latency / 1000 * engine.sample_rate))
+    else:
+        loop_buffer = LockFreeQueueBuffer((2 * block_size, engine.channels), low_watermark=block_size)
+    loop_output_started = False  # the loops are only played once the first block is ready
+
+    if args.duplex:
+        if engine.sample_rate != input_sample_rate:
+            raise ValueError(f"--duplex requires the loops to be at the input sample rate {input_sample_rate}")
+        # default input channels, the output gets the loop channels (the input is mixed into them)
+        input_stream = sd.Stream(samplerate=input_sample_rate, blocksize=block_size, latency='low',
+                                 device=(args.input, args.output), channels=(None, engine.channels),
+                                 dtype="float32", callback=duplex_callback)
+        input_channels = input_stream.channels[0]
+        input_scratch = np.zeros(block_size * input_channels, dtype=np.float32)  # for the input gain
+    else:
+        input_channels = input_stream.channels
 
-    # the time stretcher object
-    stretcher = AudioStretcher(sample_rate=loop.sample_rate, channels=loop.channels, realtime=True)
+    # input audio for the beat thread -> bounded, so a stalled beat thread drops audio instead of growing memory
+    analysis_ring = AnalysisRing((16 * block_size, input_channels), sample_rate=input_sample_rate)
 
-    # the beat tracker object
-    btrack = BeatTracker(hop_size=hop_size, frame_size=block_size)
-    btrack.fix_tempo(loop.tempo)
-    current_tempo = 120
-    beat_event = Event()
-    samples_since_last_input_beat = 0
+    # opt in timing of the callbacks and processing threads
+    instrumentation = Instrumentation(enabled=args.stats is not None)
+    if args.duplex:
+        duplex_monitor = instrumentation.add("duplex", input_sample_rate, buffer=loop_buffer)
+    else:
+        input_monitor = instrumentation.add("input", input_sample_rate, buffer=input_buffer)
+        output_monitor = instrumentation.add("output", input_sample_rate, buffer=input_buffer)
+        loop_output_monitor = instrumentation.add("loop_output", engine.sample_rate, buffer=loop_buffer)
+    beat_monitor = instrumentation.add("beat", input_sample_rate, buffer=analysis_ring)
+    stretch_monitor = instrumentation.add("stretch", engine.sample_rate, buffer=loop_buffer)
+
+    output_stream = None
+    loop_output_stream = None
+    if not args.duplex:
+        # output stream for the input stream
+        output_stream = sd.OutputStream(samplerate=input_sample_rate, blocksize=block_size, channels=input_channels,
+                                        latency='low', device=args.output, callback=output_callback)
+
+        # output stream for the mixed and stretched loops
+        loop_output_stream = sd.OutputStream(samplerate=engine.sample_rate, blocksize=block_size,
+                                             channels=engine.channels, latency='low', device=args.output,
+                                             callback=loop_output_callback)
+
+    # a beat on the input reaches the loop output after every one of these stages
+    budget = LatencyBudget() if args.latency_profile is None else LatencyBudget.from_file(args.latency_profile)
+    if args.duplex:
+        budget.set_streams(*input_stream.latency)
+    else:
+        budget.set_streams(input_stream.latency, loop_output_stream.latency)
+    budget.print_stages()
+    latency = budget.total()
+
+    # the beat detector object -> shared by all the loops
+    detector = BeatDetector(input_sample_rate, block_size=block_size, hop_size=hop_size, fixed_tempo=engine.tempo,
+                            channels=input_channels, analysis_rate=args.analysis_rate)
+    beats = BeatStream()  # timestamped beats for the main loop
     btrack_thread_alive = True
 
-    # the aubio object
-    aubio_tracker = Tempo(buf_size=block_size, hop_size=hop_size, samplerate=input_sample_rate)
-
     # the btrack thread
     def btrack_thread():
-        nonlocal btrack, beat_event, samples_since_last_input_beat, btrack_thread_alive, current_tempo, hop_size
+        nonlocal btrack_thread_alive
 
+        block = np.zeros((detector.hop_size, input_channels), dtype=np.float32)
         while btrack_thread_alive:
-            try:
-                # get newest audio block from input queue
-                block = input_queue.get(timeout=1)  # 1 second timeout
-            except Empty:
+            # keep the beat timing right if the ring had to drop audio -> skip it where the gap is in the stream
+            length = detector.hop_size
+            drop = analysis_ring.pending_drop()
+            if drop is not None:
+                until_drop = drop[0] - analysis_ring.read_idx
+                if until_drop <= 0:
+                    detector.skip(analysis_ring.take_drop())
+                    continue
+                length = min(length, until_drop)
+
+            # get the next hop of audio (or the audio up to the gap) from the analysis ring
+            if not analysis_ring.read(block, length=length, timeout=1):  # 1 second timeout
                 continue
 
-            # to mono if necessary
-            if block.ndim > 1:
-                if block.shape[1] > 1:
-                    block = librosa.to_mono(block.T)
-                else:
-                    block = np.squeeze(block)
-
-            # process the audio with btrack
-            btrack.process_audio(block)
-
-            # process audio with aubio
-            num_hops = block.shape[0] // hop_size
-            for i in range(num_hops):
-                aubio_tracker(block[i*hop_size:(i+1)*hop_size])
-
-            if btrack.beat_due_in_current_frame():
+            start = beat_monitor.start()
+            if detector.process(block[:length]):
                 print("Beat")
-                beat_event.set()
-                # TODO: should this be set to size of current block or 0??
-                samples_since_last_input_beat = np.shape(block)[0]
-                # get tempos from our two trackers
-                btrack_tempo = btrack.get_current_tempo_estimate() * (input_sample_rate / 44100)
-                aubio_tempo = aubio_tracker.get_bpm()
-                # average the tempos if aubio confidence high
-                if aubio_tracker.get_confidence() > 0.0:
-                    # adjust aubio tempo to be in same range as btrack
-                    if aubio_tempo > 1.5 * btrack_tempo:
-                        aubio_tempo /= 2
-                    elif aubio_tempo < 0.75 * btrack_tempo:
-                        aubio_tempo *= 2
-                    tempo = (aubio_tempo + btrack_tempo) / 2
-                else:
-                    tempo = btrack_tempo
-
-                if abs(tempo - current_tempo) > 0.1:
-                    current_tempo = tempo
-                    print(f"Current tempo: {current_tempo}")
-            else:
-                samples_since_last_input_beat += np.shape(block)[0]
+                beat_sample = detector.last_beat_sample
+                beats.put(beat_sample, input_clock.time_at(beat_sample), detector.tempo)
+            beat_monitor.stop(start, length)
 
     # start the thread
     btrack_thread = Thread(target=btrack_thread)
@@ -162,113 +269,51 @@ def main():
 
     # start the io streams
     input_stream.start()
-    output_stream.start()
+    if output_stream is not None:
+        output_stream.start()
+    if args.stats is not None:
+        instrumentation.start_dumping(args.stats, interval=args.stats_interval)
 
     try:
         # wait to start loop playback until the user says so
         input("Press enter to start loop playback")
 
-        # flag for starting loop output after first iteration
-        loop_output_started = False
-
-        # other counters
-        samples_til_next_input_beat = np.inf
-        samples_since_time_scale_calculated = 0
-        beat_count = 3
-
-        # other flags
-        reset_time_scale = False
-
-        # WAIT TILL NEXT BEAT
-        current_beat_length = (input_sample_rate * 60 // current_tempo)
-        if samples_since_last_input_beat >= 0.3 * current_beat_length:
-            beat_event.clear()
-            while not beat_event.is_set():  # TODO: this could result in the loop starting slightly behind
-                print('sleep')
-                time.sleep(0.002)
+        # WAIT TILL NEXT BEAT -> unless the last one was very recent
+        beat = beats.latest_nowait()
+        if beat is None or input_clock.samples - beat[0] >= 0.3 * (input_sample_rate * 60 // beat[2]):
+            beat = None
+            while beat is None:  # block on the beat stream, with a timeout so ctrl-c still works
+                beat = beats.wait(timeout=1)
+        last_beat_sample, last_beat_time, tempo = beat
 
-        beat_event.clear()  # clear before we start our loop
-        time_scale = loop.tempo / current_tempo  # initialize time scaling
+        engine.start(tempo)  # initialize time scaling
 
         # the main processing loop
         while True:
-            start = time.perf_counter()  # just for debugging
-
-            if beat_event.is_set():
-                beat_event.clear()
-
-                # count beats
-                beat_count = (beat_count + 1) % 2
-
-                if beat_count >= 0:
-                    # samples until the next beat of input stream normalized to sample rate of the loop
-                    samples_til_next_input_beat = (input_sample_rate * 60 / current_tempo -
-                                                   samples_since_last_input_beat) * loop.sample_rate / input_sample_rate
-                    # samples until next beat of loop at original timescale
-                    samples_til_next_loop_beat = loop.get_samples_til_next_beat() \
-                        + (loop_buffer.size() / time_scale)  # buffer was stretched so adjust by timescale
-
-                    print(f"loop beat idx = {loop.beat_idx}")
-                    print(f"samples till next input beat = {samples_til_next_input_beat}")
-                    print(f"samples till next loop beat = {samples_til_next_loop_beat}")
-                    print(f"samples till next loop beat stretched = {samples_til_next_loop_beat * time_scale}")
-
-                    # ADJUSTMENTS
-                    samples_til_next_input_beat -= input_stream.latency * loop.sample_rate  # this latency is in seconds
-                    samples_til_next_input_beat -= stretcher.get_latency()  # this latency is in samples
-                    print(f"samples till next input beat adjusted = {samples_til_next_input_beat}")
-
-                    # if loop is ahead, we must compress/speed up the loop -> time_scale < 1
-                    if samples_til_next_loop_beat > samples_til_next_input_beat:
-                        print("First scale IF")
-                        time_scale = samples_til_next_input_beat / samples_til_next_loop_beat
-
-                    # else if loop is behind the coming beat, we need to stretch/slow the loop -> time_scale > 1
-                    elif samples_til_next_loop_beat > 0.5 * samples_til_next_input_beat:
-                        print("Second scale IF")
-                        time_scale = samples_til_next_input_beat / samples_til_next_loop_beat
-
-                    # else if loop if slightly ahead, we need to compress/speed up the loop
-                    elif samples_til_next_loop_beat < 0.5 * samples_til_next_input_beat:
-                        print("Third scale IF")
-                        time_scale = samples_til_next_input_beat / \
-                            (samples_til_next_loop_beat + (loop.get_sample_length_of_next_beat() / time_scale))
-
-                    else:
-                        # calc the time scale using tempos
-                        time_scale = loop.tempo / current_tempo
-                        print("Last scale IF")
-
-                    # we are done beat matching!
-                    print(f"time_scale = {time_scale}")
-                    reset_time_scale = True
+            # sleep until the loop output asks for the next block
+            regions = loop_buffer.write_regions(block_size)
+            start = stretch_monitor.start()
 
-            # if not beat
-            elif reset_time_scale and samples_since_last_input_beat >= (input_sample_rate * 60 // current_tempo):
-                time_scale = loop.tempo / current_tempo
-                print(f"resetting time_scale = {time_scale}")
-                reset_time_scale = False
-
-            # stretch the audio
-            stretcher.set_time_ratio(time_scale)
-            stretcher.process(loop.get_next_block(block_size), False)
-
-            # increment counter
-            samples_since_time_scale_calculated += block_size
+            # samples since the last beat are counted to the newest input sample, not the last analyzed hop
+            beat = beats.latest_nowait()
+            if beat is not None:
+                last_beat_sample, last_beat_time, tempo = beat
+                engine.on_input_beat(tempo, input_clock.samples - last_beat_sample, loop_buffer.size(), latency)
 
-            # retrieve stretched audio in a loop until no more audio available
-            stretched = stretcher.retrieve()
-            while stretched.shape[0] > 0:
-                # wait to put new samples into loop output buffer
-                loop_buffer.put(stretched, put_incrementally=True)
+            # if not beat
+            else:
+                engine.on_block(tempo, input_clock.samples - last_beat_sample)
 
-                # see if we have more to retrieve
-                stretched = stretcher.retrieve()
+            # stretch and mix the next block of every loop straight into the loop output buffer
+            engine.process_into(regions)
+            loop_buffer.commit_write(block_size)
+            stretch_monitor.stop(start, block_size)
 
             # start the loop output stream if this was the first loop iteratoin
             if not loop_output_started:
                 loop_output_started = True
-                loop_output_stream.start()
+                if loop_output_stream is not None:
+                    loop_output_stream.start()
                 print("loop output started")
 
     except KeyboardInterrupt:
@@ -276,10 +321,24 @@ def main():
     except Exception as e:
         print(e)
     finally:
-        input_stream.stop()
-        output_stream.stop()
-        loop_output_stream.stop()
+        for stream in (input_stream, output_stream, loop_output_stream):
+            if stream is not None:
+                stream.stop()
         btrack_thread_alive = False
+        loop_buffer.close()
+        instrumentation.stop_dumping()
+        engine.close()
+        if beats.dropped > 0:
+            print(f"Main loop fell behind and dropped {beats.dropped} beats")
+        for name, buffer, sample_rate in (("input", input_buffer, input_sample_rate),
+                                          ("loop", loop_buffer, engine.sample_rate)):
+            if isinstance(buffer, JitterBuffer):
+                print(f"{name} buffer target {buffer.target / sample_rate * 1e3:.1f} ms, "
+                      f"{buffer.underflows} underflows, {buffer.dropped_frames} dropped and "
+                      f"{buffer.inserted_frames} inserted frames")
+        if analysis_ring.overruns > 0:
+            print(f"Beat thread fell behind and dropped {analysis_ring.dropped_frames} frames "
+                  f"in {analysis_ring.overruns} overruns")
 
 
 if __name__ == "__main__":
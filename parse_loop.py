@@ -5,11 +5,9 @@ detected beats, allowing the user to confirm to save
 """
 import argparse
 import numpy as np
-import soundfile as sf
-import librosa
 from pathlib import Path
 from utils.audio_loop import AudioLoop
-import sounddevice as sd
+from utils.beat_cache import BeatCache
 
 
 def parse_args():
@@ -23,6 +21,8 @@ def parse_args():
     parser.add_argument("--hop", type=int, default=512, help="beat detection hop length")
     parser.add_argument("--no-align", action="store_true", help="don't align beats to the beginning of the audio")
     parser.add_argument("--num-beats", type=int, default=None, help="predefined number of beats in track")
+    parser.add_argument("--cache-dir", type=str, default=None, help="beat analysis cache directory")
+    parser.add_argument("--no-cache", action="store_true", help="always rerun the beat analysis")
     return parser.parse_args()
 
 
@@ -32,17 +32,26 @@ def main():
     if not filepath.exists():
         raise FileNotFoundError()
 
+    cache = None
+    if not args.no_cache:
+        cache = BeatCache() if args.cache_dir is None else BeatCache(args.cache_dir)
+
     loop = AudioLoop(path=filepath, hop_length=args.hop, estimated_bpm=args.tempo,
-                     align_beats_to_start=not args.no_align)
+                     align_beats_to_start=not args.no_align, cache=cache)
 
     if args.num_beats is not None:
         print(f"Using given num_beats to compute the tempo and beat times")
         samples_per_beat = loop.samples / args.num_beats
         loop.beat_samples = np.rint(np.linspace(0, samples_per_beat*(args.num_beats-1), args.num_beats))
         loop.beat_frames = np.rint(loop.beat_samples / args.hop)
+        loop.update_beat_index()
 
     print(f"tempo: {loop.tempo}")
 
+    # librosa is slow to import so only load it once we need the click track
+    import librosa
+    import sounddevice as sd
+
     click_track = librosa.core.clicks(frames=loop.beat_frames, sr=loop.sample_rate, length=loop.samples)
     sd.play(librosa.to_mono(loop.audio.T)+click_track)
 
@@ -50,8 +59,8 @@ def main():
 
     sd.stop()
     if val == 'y':
-        loop.save(f"{filepath.stem}_LOOP.pkl")
-        print(f"Saved to {filepath.stem}_LOOP.pkl")
+        loop.save(f"{filepath.stem}_LOOP.loop")
+        print(f"Saved to {filepath.stem}_LOOP.loop")
 
     print("Goodbye!")
 
@@ -9,9 +9,9 @@ import sounddevice as sd
 import soundfile as sf
 import numpy as np
 import time
-import librosa
 from utils.queue_buffer import QueueBuffer
 from utils.input_file_stream import InputFileStream
+from utils.downmix import Downmix
 from aubio import tempo  # pylint: disable=no-name-in-module
 
 
@@ -51,21 +51,20 @@ def main():
     beat_tracker = tempo(hop_size=hop_size, buf_size=block_size, samplerate=sample_rate)
 
     current_tempo = 120
+    downmix = Downmix(2, max_frames=block_size)
 
     def btrack_callback(block: np.ndarray, frames):
-        nonlocal current_tempo, beat_tracker, hop_size
+        nonlocal current_tempo, beat_tracker, hop_size, downmix
 
         block = block[:frames]
-        if block.ndim > 1:
-            if block.shape[1] > 1:
-                block = librosa.to_mono(block.T)
-            else:
-                block = np.squeeze(block)
+        if block.ndim > 1 and block.shape[1] != downmix.channels:
+            downmix = Downmix(block.shape[1], max_frames=block_size)
+        block = downmix.process(block)
 
+        # each hop is a view of the mono block
         is_beat = False
-        num_hops = frames // hop_size
-        for i in range(num_hops):
-            bt = beat_tracker(block[i*hop_size:(i+1)*hop_size])
+        for start in range(0, frames - hop_size + 1, hop_size):
+            bt = beat_tracker(block[start:start + hop_size])
             is_beat = is_beat or bt
 
         if is_beat:
@@ -0,0 +1,53 @@
+"""
+This program checks that the BeatDetector reports the fixed tempo it was given at every analysis rate,
+by running a click track through it. No audio devices are needed. Exits with an error if any doesn't.
+"""
+import argparse
+import sys
+import numpy as np
+from utils.beat_detector import BeatDetector
+from utils.latency import make_click_track
+
+
+def parse_args():
+    """
+    Parses command line arguments.
+    Args: tempo, sample-rate, analysis-rate, block-size, seconds, tolerance
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-t", "--tempo", type=float, default=120.0, help="tempo of the click track and fixed tempo")
+    parser.add_argument("--sample-rate", type=int, default=44100, help="sample rate of the click track")
+    parser.add_argument("--analysis-rate", type=int, nargs="+", default=[44100, 22050, 11025],
+                        help="analysis rates to check (as in main.py)")
+    parser.add_argument("-b", "--block-size", type=int, default=1024, help="audio block size in frames")
+    parser.add_argument("--seconds", type=float, default=10.0, help="length of the click track")
+    parser.add_argument("--tolerance", type=float, default=1.0, help="largest tempo error in bpm")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    track, _ = make_click_track(args.sample_rate, args.seconds, tempo=args.tempo)
+
+    failed = False
+    for analysis_rate in args.analysis_rate:
+        detector = BeatDetector(args.sample_rate, block_size=args.block_size, fixed_tempo=args.tempo, verbose=False,
+                                channels=1, analysis_rate=analysis_rate)
+
+        block = np.zeros((args.block_size, 1), dtype=np.float32)
+        beats = 0
+        for start in range(0, track.shape[0] - args.block_size, args.block_size):
+            block[:, 0] = track[start:start + args.block_size]
+            beats += detector.process(block)
+
+        ok = beats > 0 and abs(detector.tempo - args.tempo) <= args.tolerance
+        failed = failed or not ok
+        print(f"analysis rate {detector.analysis_rate:>8.0f} Hz (decimation {detector.decimation}): "
+              f"{beats} beats, tempo {detector.tempo:.2f} -> {'OK' if ok else 'FAILED'}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,10 +8,10 @@ import sounddevice as sd
 import soundfile as sf
 import numpy as np
 import time
-import librosa
 from lib.btrack import BeatTracker  # pylint: disable=import-error,no-name-in-module
 from utils.queue_buffer import QueueBuffer
 from utils.input_file_stream import InputFileStream
+from utils.downmix import Downmix
 
 
 def parse_args():
@@ -48,17 +48,16 @@ def main():
     btrack = BeatTracker(hop_size=block_size, frame_size=block_size)
 
     tempo = 120
+    downmix = Downmix(2, max_frames=block_size)
 
     def btrack_callback(block: np.ndarray, frames):
-        nonlocal tempo, btrack
+        nonlocal tempo, btrack, downmix
 
         block = block[:frames]
 
-        if block.ndim > 1:
-            if block.shape[1] > 1:
-                block = librosa.to_mono(block.T)
-            else:
-                block = np.squeeze(block)
+        if block.ndim > 1 and block.shape[1] != downmix.channels:
+            downmix = Downmix(block.shape[1], max_frames=block_size)
+        block = downmix.process(block)
         btrack.process_audio(block)
 
         if btrack.beat_due_in_current_frame():
@@ -4,7 +4,7 @@ This program routes input in real time from either the default input device or g
 to the given output device
 """
 from utils.input_file_stream import InputFileStream
-from utils.queue_buffer import QueueBuffer
+from utils.queue_buffer import QueueBuffer, JitterBuffer
 import librosa
 import time
 import numpy as np
@@ -30,6 +30,9 @@ def parse_args():
                         help="either input device # or file to stream as input")
     parser.add_argument("-d", "--device", type=int_or_str, help="output device")
     parser.add_argument("-b", "--block-size", type=int, default=1024, help="audio block size in frames")
+    parser.add_argument("-a", "--adaptive", action="store_true",
+                        help="adapt the buffering to the lowest latency the host sustains instead of 10240 frames")
+    parser.add_argument("--max-latency", type=float, default=100.0, help="latency ceiling in ms with --adaptive")
 
     return parser.parse_args()
 
@@ -45,7 +48,10 @@ def main():
     sample_rate = 44100
 
     def input_callback(indata, frames, *args, **kwargs):
-        buffer.put(indata, frames)
+        if isinstance(buffer, JitterBuffer):
+            buffer.put_nowait(indata, frames)
+        else:
+            buffer.put(indata, frames)
 
     def output_callback(outdata, frames, *args, **kwargs):
         if not buffer.get_into_nowait(outdata, length=frames):
@@ -60,6 +66,10 @@ def main():
         sample_rate = input.sample_rate  # default sample rate
     print(f"Sample rate: {sample_rate}")
 
+    if args.adaptive:
+        buffer = JitterBuffer((4 * block_size, 2), block_size, correct_drift=True,
+                              max_target=int(args.max_latency / 1000 * sample_rate))
+
     output = sd.OutputStream(blocksize=block_size, samplerate=sample_rate, latency='low',
                              device=output_device, callback=output_callback)
     try:
@@ -72,6 +82,8 @@ def main():
             time.sleep(1)
             print(f"input latency: {input.latency}")
             print(f"output latency: {output.latency}")
+            if args.adaptive:
+                print(f"buffer latency: {buffer.target / sample_rate} ({buffer.underflows} underflows)")
 
     except KeyboardInterrupt:
         print('\nInterrupted by user')
@@ -1,10 +1,6 @@
-
-import sounddevice as sd
-import soundfile as sf
 import numpy as np
-import time
-import librosa
-from utils.circular_buffer import CircularBuffer
+from utils.circular_buffer import CircularBuffer, MirroredCircularBuffer
+from utils.loop_file import save_loop_file, load_loop_file, is_loop_file
 import pickle
 from pathlib import Path
 # input
@@ -12,12 +8,16 @@ from pathlib import Path
 
 # output
 class AudioLoop(object):
-    def __init__(self, path="drummer_120.wav", estimated_bpm=120.0, hop_length=512, block_size=1024, align_beats_to_start=True, data=None):
+    def __init__(self, path="drummer_120.wav", estimated_bpm=120.0, hop_length=512, block_size=1024, align_beats_to_start=True, data=None,
+                 cache=None):
         if isinstance(data, dict):
              # just update by attribute name
             for key, val in data.items():
                 self.__dict__[key] = val
         else:
+            # only import this when analyzing -> loading a saved loop doesn't need it
+            import soundfile as sf
+
             # These are all saved variables
             self.audio, self.sample_rate = sf.read(str(path), dtype="float32")
 
@@ -28,8 +28,7 @@ class AudioLoop(object):
                 self.audio = np.expand_dims(self.audio, axis=1)
             self.channels = self.audio.shape[1]
 
-            self.tempo, self.beat_frames = librosa.beat.beat_track(librosa.to_mono(self.audio.T), sr=self.sample_rate,
-                                                                   hop_length=self.hop_length, start_bpm=estimated_bpm, units='frames', trim=False)
+            self.tempo, self.beat_frames = self._detect_beats(estimated_bpm, cache)
 
             self.num_frames_adjusted = 0
             if align_beats_to_start:
@@ -45,36 +44,71 @@ class AudioLoop(object):
         # initialize unsaved variables
         self._init_unsaved_variables()
 
+    def _detect_beats(self, estimated_bpm, cache=None):
+        """Run the librosa beat tracker, or get its results from the given BeatCache"""
+        if cache is not None:
+            key = cache.get_key(self.audio, self.sample_rate, hop_length=self.hop_length, estimated_bpm=estimated_bpm)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+
+        # librosa is slow to import so only load it if we actually analyze
+        import librosa
+
+        tempo, beat_frames = librosa.beat.beat_track(librosa.to_mono(self.audio.T), sr=self.sample_rate,
+                                                     hop_length=self.hop_length, start_bpm=estimated_bpm, units='frames', trim=False)
+
+        if cache is not None:
+            cache.put(key, tempo, beat_frames)
+        return tempo, beat_frames
+
     def _init_unsaved_variables(self):
         # These are not saved
+        if "mirrored_audio" not in self.__dict__:
+            # audio with the start repeated past the end (only when loaded from a loop file)
+            self.mirrored_audio = None
+            self.mirror_frames = 0
+
         self.buffer = CircularBuffer(buffer=self.audio)
         self.buf_idx = 0
+        self.scratch = np.zeros((0, self.channels), dtype=self.audio.dtype)
 
         self.beat_samples = self.beat_frames * self.hop_length
-        self.beat_idx = 0
+        self.update_beat_index()
 
         self.cur_idx = 0
 
     def save(self, filename):
-        with open(filename, "wb") as f:
-            data = {
-                "audio": self.audio,
-                "sample_rate": self.sample_rate,
-                "beat_frames": self.beat_frames,
-                "tempo": self.tempo,
-                "block_size": self.block_size,
-                "hop_length": self.hop_length,
-                "samples": self.samples,
-                "channels": self.channels,
-                "num_frames_adjusted": self.num_frames_adjusted
-            }
-            pickle.dump(data, f)
+        """Save to the binary loop file format (see loop_file.py)"""
+        data = {
+            "audio": self.audio,
+            "sample_rate": self.sample_rate,
+            "beat_frames": self.beat_frames,
+            "tempo": self.tempo,
+            "block_size": self.block_size,
+            "hop_length": self.hop_length,
+            "samples": self.samples,
+            "channels": self.channels,
+            "num_frames_adjusted": self.num_frames_adjusted
+        }
+        save_loop_file(filename, data)
 
     @classmethod
-    def from_file(cls, filename):
+    def from_file(cls, filename, mmap=True, allow_pickle=False):
+        """
+        Load a loop file, memory mapping the audio if mmap.
+        Old pickled *_LOOP.pkl files are only loaded with allow_pickle -> only do this with files you trust!
+        """
         if not Path(filename).exists():
             raise FileNotFoundError()
 
+        if is_loop_file(filename):
+            return cls(data=load_loop_file(filename, mmap=mmap))
+
+        if not allow_pickle:
+            raise ValueError(f"{filename} is not a loop file. If it is an old pickled loop you trust, "
+                             f"convert it with convert_loops.py")
+
         with open(filename, "rb") as f:
             data = pickle.load(f)
 
@@ -92,41 +126,63 @@ class AudioLoop(object):
         self._increment_beat_idx()
         return output
 
+    def get_next_block_view(self, num_frames: int) -> np.ndarray:
+        """
+        Like get_next_block() but without allocating: returns a view into the loop audio,
+        or into a reused scratch array when the block wraps around the end of the loop.
+        The result is only valid until the next call -> DON'T write to it!
+        """
+        if self.scratch.shape[0] < num_frames:
+            self.scratch = np.zeros((num_frames, self.channels), dtype=self.audio.dtype)
+
+        self.buf_idx, output = self.buffer.get_view(self.buf_idx, num_frames, scratch=self.scratch)
+        self._increment_beat_idx()
+        return output
+
+    def use_mirrored_buffer(self, max_block_size: int):
+        """Mirror the start of the loop past its end so get_next_block_view() never copies for blocks <= max_block_size"""
+        mirror_length = min(max_block_size, self.samples)
+
+        # loop files already hold the mirrored frames -> no copy of the (possibly memory mapped) audio
+        if self.mirrored_audio is not None and self.mirror_frames >= mirror_length:
+            self.buffer = MirroredCircularBuffer.from_mirrored(self.mirrored_audio, self.mirror_frames)
+        else:
+            self.buffer = MirroredCircularBuffer(buffer=self.audio, mirror_length=mirror_length)
+
     def get_next_block_into(self, num_frames: int, buffer: np.ndarray):
         self.buf_idx = self.buffer.get_into(self.buf_idx, buffer, num_frames)
         self._increment_beat_idx()
 
+    def skip(self, num_frames: int):
+        """Move the loop position without reading, backwards if num_frames is negative"""
+        self.buf_idx = (self.buf_idx + num_frames) % self.samples
+        self._increment_beat_idx()
+
+    def update_beat_index(self):
+        """Precompute the beat lookups -> call this again if beat_samples is changed"""
+        self.beat_samples = np.asarray(self.beat_samples).astype(np.int64)
+        self.num_beats = self.beat_samples.shape[0]
+
+        # the last beat wraps around to the first beat of the next loop
+        self.beat_lengths = np.diff(np.append(self.beat_samples, self.beat_samples[0] + self.samples))
+        self.beat_idx = self.get_beat_at_sample(self.buf_idx)
+
     def _increment_beat_idx(self):
-        # if we are on the last beat idx
-        if self.beat_idx == self.beat_samples.shape[0] - 1:
-            # if buf_idx is past the first beat marker and less than the last beat indx
-            if self.buf_idx >= self.beat_samples[0] and self.buf_idx < self.beat_samples[-1]:
-                self.beat_idx = 0
-        else:
-            next_beat_idx = self.beat_idx + 1
-            # if buf_idx is past the next beat marker, increment beat idx
-            if self.buf_idx >= self.beat_samples[self.beat_idx + 1]:
-                self.beat_idx += 1
+        # look the beat up instead of stepping, so blocks spanning several beats are handled
+        self.beat_idx = self.get_beat_at_sample(self.buf_idx)
+
+    def get_beat_at_sample(self, sample) -> int:
+        """Index of the beat that the given sample of the loop is in"""
+        # samples before the first beat are still in the last beat of the previous loop
+        return (int(np.searchsorted(self.beat_samples, sample % self.samples, side="right")) - 1) % self.num_beats
 
     def get_samples_til_next_beat(self) -> int:
-        # if we are on the last beat idx
-        if self.beat_idx == self.beat_samples.shape[0] - 1:
-            # return samples from beginning till first beat + samples left in buffer
-            return self.beat_samples[0] + self.buffer.buf_size - self.buf_idx
-        else:
-            # return sample idx of next beat - current buffer idx
-            return self.beat_samples[self.beat_idx+1] - self.buf_idx
+        # wraps around the loop, and a loop with one beat is a whole loop away from its next beat
+        next_beat = self.beat_samples[(self.beat_idx + 1) % self.num_beats]
+        return int(next_beat - self.buf_idx) % self.samples or self.samples
 
     def get_sample_length_of_beat(self, beat_idx) -> int:
-        beat_idx = beat_idx % self.beat_samples.shape[0]
-
-        # if we are on the last beat idx
-        if beat_idx == self.beat_samples.shape[0] - 1:
-            # return samples from beginning till first beat + samples left in buffer since current beat
-            return self.beat_samples[0] + self.buffer.buf_size - self.beat_samples[-1]
-        else:
-            # return difference of consecutive beat samples
-            return self.beat_samples[beat_idx+1] - self.beat_samples[beat_idx]
+        return int(self.beat_lengths[beat_idx % self.num_beats])
 
     def get_sample_length_of_next_beat(self) -> int:
         return self.get_sample_length_of_beat(self.beat_idx + 1)
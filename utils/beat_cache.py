@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+from pathlib import Path
+
+
+# bump this whenever the beat analysis changes so old results aren't reused
+ANALYSIS_VERSION = 1
+
+
+class BeatCache(object):
+    """
+    On disk cache of beat analysis results (tempo and beat frames)
+
+    Results are keyed by a hash of the audio content plus the analysis parameters, so renamed
+    or copied files still hit the cache. Each entry is a small json file and the least recently
+    used entries are deleted once there are more than max_entries.
+    Any number of processes can share one directory, so entries may vanish at any time.
+    """
+
+    def __init__(self, directory=Path.home() / ".cache" / "audiostretch" / "beats", max_entries=2000):
+        self.directory = Path(directory)
+        self.max_entries = max_entries
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def get_key(audio: np.ndarray, sample_rate, **params) -> str:
+        h = hashlib.sha256()
+        h.update(np.ascontiguousarray(audio).data)
+        h.update(json.dumps({"version": ANALYSIS_VERSION, "sample_rate": sample_rate,
+                             "dtype": audio.dtype.str, "shape": audio.shape, **params}, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def _path(self, key) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key):
+        """Returns (tempo, beat_frames) or None if not cached"""
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass  # evicted by another process since it was read
+        return entry["tempo"], np.array(entry["beat_frames"], dtype=np.int64)
+
+    def put(self, key, tempo, beat_frames):
+        path = self._path(key)
+        # a unique temp file per writer, replaced atomically so concurrent readers never see half an entry
+        with tempfile.NamedTemporaryFile("w", dir=self.directory, suffix=".tmp", delete=False) as f:
+            json.dump({"tempo": float(np.squeeze(tempo)), "beat_frames": np.asarray(beat_frames).tolist()}, f)
+        try:
+            os.replace(f.name, path)
+        except OSError:
+            os.unlink(f.name)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries until at most max_entries remain"""
+        entries = []
+        for path in self.directory.glob("*.json"):
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                pass  # deleted by another process
+        if len(entries) <= self.max_entries:
+            return
+
+        entries.sort()
+        for _, path in entries[:len(entries) - self.max_entries]:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,171 @@
+import numpy as np
+from lib.btrack import BeatTracker  # pylint: disable=import-error,no-name-in-module
+from aubio import tempo as Tempo  # pylint: disable=no-name-in-module
+from utils.downmix import Downmix
+from utils.decimator import Decimator
+
+
+class BeatDetector(object):
+    """
+    Real time beat and tempo detection using BTrack and aubio together.
+
+    BTrack decides when beats happen and both trackers are averaged for the tempo estimate.
+    This holds no threads -> call process() with each new input block from whichever thread you like.
+
+    Blocks can be any size: they are downmixed straight into a mono accumulator and the trackers
+    are run on views of every complete hop, so the analysis hop doesn't have to match the audio block size.
+
+    With analysis_rate set, the mono audio is decimated by an integer factor before the trackers, which makes
+    the analysis cheaper on 88.2/96 kHz inputs. BTrack only tracks 80-160 bpm at the 44.1 kHz it assumes, so
+    the factor is limited to keep the expected tempo (fixed_tempo, else tempo) in that range: at 120 bpm
+    that's no decimation at 44.1/48 kHz and 2 at 96 kHz. hop_size, frame_size and samples_since_last_beat
+    are always in input samples.
+
+    Beats are also timestamped with the absolute input sample index of the hop they were detected in
+    (last_beat_sample), counting every input frame given to process() or skip().
+    """
+
+    def __init__(self, sample_rate, block_size=1024, hop_size=None, tempo=120.0, fixed_tempo=None, verbose=True,
+                 channels=2, channel_weights=None, frame_size=None, analysis_rate=None):
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.hop_size = block_size if hop_size is None else hop_size
+        self.verbose = verbose
+
+        # analysis frame size -> twice the hop unless the hop is the whole block
+        if frame_size is None:
+            frame_size = self.block_size if self.hop_size == self.block_size else 2 * self.hop_size
+        self.frame_size = frame_size
+
+        # decimate by the integer factor closest to the requested analysis rate
+        self.decimation = 1
+        if analysis_rate is not None and analysis_rate < sample_rate:
+            self.decimation = max(1, int(round(sample_rate / analysis_rate)))
+
+            # btrack assumes 44.1 kHz and only tracks 80-160 bpm -> it sees the tempo scaled by 44100 / analysis rate,
+            # so don't decimate so far that the expected tempo goes over 160 (it would be folded to half)
+            expected_tempo = tempo if fixed_tempo is None else fixed_tempo
+            max_decimation = max(1, int(160 * sample_rate / (44100 * expected_tempo)))
+            if self.decimation > max_decimation:
+                if verbose:
+                    print(f"BTrack can't track {expected_tempo} bpm at {sample_rate / self.decimation:.0f} Hz, "
+                          f"decimating by {max_decimation} instead of {self.decimation}")
+                self.decimation = max_decimation
+        if self.hop_size % self.decimation != 0:
+            raise ValueError(f"hop size {self.hop_size} must be a multiple of the decimation factor {self.decimation}")
+        self.analysis_rate = sample_rate / self.decimation
+        self.analysis_hop = self.hop_size // self.decimation
+
+        # preallocated downmix to mono
+        self.channel_weights = channel_weights
+        self.downmix = Downmix(channels, max_frames=block_size, weights=channel_weights)
+        self.decimator = Decimator(self.decimation, max_frames=block_size) if self.decimation > 1 else None
+
+        # mono analysis audio waiting to be analyzed -> never more than a hop left over between blocks
+        self.mono = np.zeros(self.block_size // self.decimation + self.analysis_hop + 1, dtype=np.float32)
+        self.pending = 0
+
+        # the beat tracker object
+        self.btrack = BeatTracker(hop_size=self.analysis_hop, frame_size=self.frame_size // self.decimation)
+        if fixed_tempo is not None:
+            # btrack assumes 44.1 kHz, so it sees the tempo scaled by the rate it actually runs at
+            self.btrack.fix_tempo(fixed_tempo * 44100 / self.analysis_rate)
+
+        # the aubio object
+        self.aubio_tracker = Tempo(buf_size=self.frame_size // self.decimation, hop_size=self.analysis_hop,
+                                   samplerate=int(self.analysis_rate))
+
+        # detected state
+        self.tempo = tempo
+        self.samples_since_last_beat = 0
+
+        # absolute input sample index of the next hop and of the start of the hop with the last beat
+        self.sample_index = 0
+        self.last_beat_sample = None
+
+    def process(self, block: np.ndarray) -> bool:
+        """
+        Process the next input block (any number of frames) and return True if a beat was detected in it.
+        Frames that don't fill a whole hop are kept and analyzed with the next block.
+        """
+        if block.ndim > 1 and block.shape[1] != self.downmix.channels:
+            self.downmix = Downmix(block.shape[1], max_frames=self.block_size, weights=self.channel_weights)
+
+        beat = False
+        hop_size = self.analysis_hop
+        frames = block.shape[0]
+        start = 0
+        while start < frames:
+            # downmix (and decimate) as much as fits straight into the accumulator
+            space = self.mono.shape[0] - self.pending
+            if self.decimator is None:
+                num_frames = min(frames - start, space)
+                self.downmix.process(block[start:start + num_frames], output=self.mono[self.pending:])
+                self.pending += num_frames
+            else:
+                num_frames = min(frames - start, self.block_size, space * self.decimation)
+                mono = self.downmix.process(block[start:start + num_frames])
+                self.pending += self.decimator.process(mono, output=self.mono[self.pending:]).shape[0]
+            start += num_frames
+
+            # analyze every complete hop -> each hop is a view of the accumulator
+            offset = 0
+            while self.pending - offset >= hop_size:
+                beat = self._process_hop(self.mono[offset:offset + hop_size]) or beat
+                offset += hop_size
+
+            # move the leftover (less than a hop) to the front
+            if offset > 0:
+                leftover = self.pending - offset
+                self.mono[:leftover] = self.mono[offset:self.pending]
+                self.pending = leftover
+
+        return beat
+
+    def skip(self, num_frames):
+        """Advance the sample clock over input frames that were never analyzed (eg dropped by a full ring)"""
+        self.sample_index += num_frames
+        self.samples_since_last_beat += num_frames
+
+    def _process_hop(self, hop: np.ndarray) -> bool:
+        # process the audio with btrack and aubio
+        self.btrack.process_audio(hop)
+        self.aubio_tracker(hop)
+
+        hop_start = self.sample_index
+        self.sample_index += self.hop_size
+
+        if not self.btrack.beat_due_in_current_frame():
+            self.samples_since_last_beat += self.hop_size
+            return False
+
+        # TODO: should this be set to size of current hop or 0??
+        self.samples_since_last_beat = self.hop_size
+        self.last_beat_sample = hop_start
+        self._update_tempo()
+        return True
+
+    def _update_tempo(self):
+        # get tempos from our two trackers
+        # btrack assumes 44.1 kHz, so rescale by the rate it actually sees
+        btrack_tempo = self.btrack.get_current_tempo_estimate() * (self.analysis_rate / 44100)
+        aubio_tempo = self.aubio_tracker.get_bpm()
+        # average the tempos if aubio confidence high
+        if self.aubio_tracker.get_confidence() > 0.0:
+            # adjust aubio tempo to be in same range as btrack
+            if aubio_tempo > 1.5 * btrack_tempo:
+                aubio_tempo /= 2
+            elif aubio_tempo < 0.75 * btrack_tempo:
+                aubio_tempo *= 2
+            tempo = (aubio_tempo + btrack_tempo) / 2
+        else:
+            tempo = btrack_tempo
+
+        if abs(tempo - self.tempo) > 0.1:
+            self.tempo = tempo
+            if self.verbose:
+                print(f"Current tempo: {self.tempo}")
+
+    def get_beat_length(self) -> float:
+        """Number of input samples in one beat at the current tempo"""
+        return self.sample_rate * 60 / self.tempo
@@ -0,0 +1,108 @@
+import numpy as np
+from threading import Event
+
+
+class StreamClock(object):
+    """
+    Maps absolute input sample indices to stream time
+
+    The input callback calls update() with every block, which counts the frames received so far and
+    remembers the stream time (sounddevice's time_info.inputBufferAdcTime) of the first frame of the block.
+    Any thread can then read samples and convert a sample index to a time with time_at().
+    Without time_info (eg InputFileStream) the time is just the sample index over the sample rate.
+    """
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.samples = 0  # absolute number of input frames received
+        self.reference = (0, 0.0)  # (sample index, stream time) of the start of the last block
+
+    def update(self, frames, time_info=None):
+        """Call from the input callback before anything else uses the block"""
+        samples = self.samples
+        if time_info is None:
+            adc_time = samples / self.sample_rate
+        else:
+            adc_time = time_info.inputBufferAdcTime
+
+        self.reference = (samples, adc_time)  # one assignment so readers never see half an update
+        self.samples = samples + frames
+
+    def time_at(self, sample) -> float:
+        reference_sample, reference_time = self.reference
+        return reference_time + (sample - reference_sample) / self.sample_rate
+
+
+class BeatStream(object):
+    """
+    Single producer/single consumer queue of timestamped beats
+
+    Each beat is (absolute input sample index, stream time, tempo). The arrays are preallocated and
+    the write index is published after the beat is written, like LockFreeQueueBuffer.
+    If the consumer falls behind the newest beats are dropped and counted.
+
+    The consumer can block in wait() on an Event set by the producer instead of polling,
+    so only put() from a thread that is allowed to touch an Event (not an audio callback).
+    """
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.sample = np.zeros(capacity, dtype=np.int64)
+        self.time = np.zeros(capacity, dtype=np.float64)
+        self.tempo = np.zeros(capacity, dtype=np.float64)
+
+        self.write_idx = 0
+        self.read_idx = 0
+        self.dropped = 0
+        self.event = Event()
+
+    def size(self):
+        return self.write_idx - self.read_idx
+
+    def put(self, sample, time, tempo) -> bool:
+        write_idx = self.write_idx
+        if write_idx - self.read_idx >= self.capacity:
+            self.dropped += 1
+            return False
+
+        i = write_idx % self.capacity
+        self.sample[i] = sample
+        self.time[i] = time
+        self.tempo[i] = tempo
+        self.write_idx = write_idx + 1  # publish after the write
+        self.event.set()
+        return True
+
+    def get_nowait(self):
+        """The oldest beat as (sample, time, tempo), or None if there are none"""
+        read_idx = self.read_idx
+        if read_idx >= self.write_idx:
+            return None
+
+        i = read_idx % self.capacity
+        beat = (int(self.sample[i]), float(self.time[i]), float(self.tempo[i]))
+        self.read_idx = read_idx + 1  # publish after the read
+        return beat
+
+    def latest_nowait(self):
+        """Skip to the newest beat and return it, or None if there are no new beats"""
+        beat = None
+        next_beat = self.get_nowait()
+        while next_beat is not None:
+            beat = next_beat
+            next_beat = self.get_nowait()
+        return beat
+
+    def wait(self, timeout=None):
+        """Block until there is a beat and return the oldest one, or None if the timeout (seconds) ran out"""
+        beat = self.get_nowait()
+        while beat is None:
+            # clear before checking again so a put() between the check and the wait is never missed
+            self.event.clear()
+            beat = self.get_nowait()
+            if beat is not None:
+                break
+            if not self.event.wait(timeout):
+                return None
+            beat = self.get_nowait()
+        return beat
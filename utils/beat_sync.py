@@ -0,0 +1,92 @@
+from utils.audio_loop import AudioLoop
+
+
+class BeatSync(object):
+    """
+    Beat matching of an AudioLoop against an input stream.
+
+    This computes the time_scale that the loop should be stretched by so that
+    the next beat of the loop lands on the next beat of the input.
+    """
+
+    def __init__(self, loop: AudioLoop, input_sample_rate, tempo, verbose=True):
+        self.loop = loop
+        self.input_sample_rate = input_sample_rate
+        self.verbose = verbose
+
+        self.beat_count = 3
+        self.reset_time_scale = False
+        self.time_scale = loop.tempo / tempo  # initialize time scaling
+        self.tempo_scale = self.time_scale  # time_scale that only matches the tempos, without beat corrections
+
+    def _print(self, *args):
+        if self.verbose:
+            print(*args)
+
+    def on_input_beat(self, current_tempo, samples_since_last_input_beat, queued_samples, latency_samples) -> float:
+        """
+        Call when a beat was detected on the input.
+        queued_samples are stretched loop samples waiting to be played, latency_samples are in loop samples
+        """
+        # count beats
+        self.beat_count = (self.beat_count + 1) % 2
+        self.tempo_scale = self.loop.tempo / current_tempo
+
+        if self.beat_count < 0:
+            return self.time_scale
+
+        loop = self.loop
+        time_scale = self.time_scale
+
+        # samples until the next beat of input stream normalized to sample rate of the loop
+        samples_til_next_input_beat = (self.input_sample_rate * 60 / current_tempo -
+                                       samples_since_last_input_beat) * loop.sample_rate / self.input_sample_rate
+        # samples until next beat of loop at original timescale
+        samples_til_next_loop_beat = loop.get_samples_til_next_beat() \
+            + (queued_samples / time_scale)  # buffer was stretched so adjust by timescale
+
+        self._print(f"loop beat idx = {loop.beat_idx}")
+        self._print(f"samples till next input beat = {samples_til_next_input_beat}")
+        self._print(f"samples till next loop beat = {samples_til_next_loop_beat}")
+        self._print(f"samples till next loop beat stretched = {samples_til_next_loop_beat * time_scale}")
+
+        # ADJUSTMENTS
+        samples_til_next_input_beat -= latency_samples
+        self._print(f"samples till next input beat adjusted = {samples_til_next_input_beat}")
+
+        # if loop is ahead, we must compress/speed up the loop -> time_scale < 1
+        if samples_til_next_loop_beat > samples_til_next_input_beat:
+            self._print("First scale IF")
+            time_scale = samples_til_next_input_beat / samples_til_next_loop_beat
+
+        # else if loop is behind the coming beat, we need to stretch/slow the loop -> time_scale > 1
+        elif samples_til_next_loop_beat > 0.5 * samples_til_next_input_beat:
+            self._print("Second scale IF")
+            time_scale = samples_til_next_input_beat / samples_til_next_loop_beat
+
+        # else if loop if slightly ahead, we need to compress/speed up the loop
+        elif samples_til_next_loop_beat < 0.5 * samples_til_next_input_beat:
+            self._print("Third scale IF")
+            time_scale = samples_til_next_input_beat / \
+                (samples_til_next_loop_beat + (loop.get_sample_length_of_next_beat() / time_scale))
+
+        else:
+            # calc the time scale using tempos
+            time_scale = loop.tempo / current_tempo
+            self._print("Last scale IF")
+
+        # we are done beat matching!
+        self._print(f"time_scale = {time_scale}")
+        self.time_scale = time_scale
+        self.reset_time_scale = True
+        return self.time_scale
+
+    def on_block(self, current_tempo, samples_since_last_input_beat) -> float:
+        """Call once per block when there was no input beat -> resets the time_scale after a beat is missed"""
+        self.tempo_scale = self.loop.tempo / current_tempo
+        if self.reset_time_scale and samples_since_last_input_beat >= (self.input_sample_rate * 60 // current_tempo):
+            self.time_scale = self.loop.tempo / current_tempo
+            self._print(f"resetting time_scale = {self.time_scale}")
+            self.reset_time_scale = False
+
+        return self.time_scale
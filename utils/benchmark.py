@@ -0,0 +1,74 @@
+import json
+import time
+import numpy as np
+from pathlib import Path
+
+
+def time_calls(func, iterations=1000, setup=None, warmup=10) -> np.ndarray:
+    """Returns the time in seconds of each call to func(). setup() is called untimed before each call"""
+    times = np.zeros(iterations)
+    for i in range(warmup + iterations):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times[i - warmup] = elapsed
+    return times
+
+
+def summarize(times: np.ndarray, frames_per_call) -> dict:
+    """Latency percentiles in microseconds and throughput in frames per second"""
+    return {
+        "p50_us": float(np.percentile(times, 50) * 1e6),
+        "p99_us": float(np.percentile(times, 99) * 1e6),
+        "max_us": float(np.max(times) * 1e6),
+        "frames_per_sec": float(frames_per_call * times.shape[0] / np.sum(times)),
+    }
+
+
+def best_of(summaries: list) -> dict:
+    """Combine the summaries of repeated runs of one case, keeping the fastest of each stat"""
+    best = {}
+    for key in summaries[0]:
+        values = [summary[key] for summary in summaries]
+        best[key] = max(values) if key == "frames_per_sec" else min(values)
+    return best
+
+
+def print_results(results: dict):
+    print(f"{'case':<52}{'p50 us':>10}{'p99 us':>10}{'max us':>10}{'Mframes/s':>12}")
+    for name, stats in results.items():
+        print(f"{name:<52}{stats['p50_us']:>10.2f}{stats['p99_us']:>10.2f}{stats['max_us']:>10.2f}"
+              f"{stats['frames_per_sec'] / 1e6:>12.2f}")
+
+
+def save_baseline(filename, results: dict):
+    with open(filename, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_baseline(filename) -> dict:
+    if not Path(filename).exists():
+        raise FileNotFoundError(filename)
+
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def find_regressions(results: dict, baseline: dict, tolerance=0.3, keys=("p50_us",), floor=0.0) -> list:
+    """
+    Returns a description of every case whose given stats are more than tolerance slower than the baseline,
+    and slower by more than floor (in the units of the stat). The floor keeps the timer noise of very short
+    calls from counting, and tail stats like p99 are too noisy to gate on, so they are left out by default.
+    """
+    regressions = []
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        for key in keys:
+            allowed = max(baseline[name][key] * (1 + tolerance), baseline[name][key] + floor)
+            if stats[key] > allowed:
+                regressions.append(f"{name} {key}: {stats[key]:.2f} > {allowed:.2f} (baseline {baseline[name][key]:.2f})")
+    return regressions
@@ -25,7 +25,7 @@ class CircularBuffer(object):
         if idx + length >= self.buf_size:
             frames_left = self.buf_size - idx
             extra_frames = length - frames_left
-            self.buffer[idx:] = data[:frames_left]
+            self.buffer[idx:self.buf_size] = data[:frames_left]
             self.buffer[:extra_frames] = data[frames_left:length]
             return extra_frames
         else:
@@ -42,7 +42,7 @@ class CircularBuffer(object):
         if idx + length >= self.buf_size:
             frames_left = self.buf_size - idx
             extra_frames = length - frames_left
-            output[:frames_left] = self.buffer[idx:]
+            output[:frames_left] = self.buffer[idx:self.buf_size]
             output[frames_left:length] = self.buffer[:extra_frames]
             return extra_frames
         else:
@@ -55,3 +55,91 @@ class CircularBuffer(object):
         next_idx = self.get_into(idx, output)
 
         return next_idx, output
+
+    def get_view(self, idx, length, scratch: np.ndarray = None):
+        """
+        Like get() but returns a view into the buffer when the span doesn't wrap.
+        When it does wrap, the frames are copied into scratch (allocated if None) and scratch[:length] is returned.
+        The returned array is only valid until the buffer or scratch is written again -> DON'T write to it!
+        """
+        if idx + length <= self.buf_size:
+            return (idx + length) % self.buf_size, self.buffer[idx: idx + length]
+
+        if scratch is None:
+            return self.get(idx, length)
+
+        next_idx = self.get_into(idx, scratch, length=length)
+        return next_idx, scratch[:length]
+
+    def get_regions(self, idx, length) -> tuple:
+        """
+        Views of the length frames from idx: one view, or two when they wrap around the end.
+        Writing into them writes straight into the buffer (without updating any mirrored frames).
+        """
+        if length > self.buf_size:
+            raise ValueError("given length is larger than circular buffer")
+
+        if idx + length <= self.buf_size:
+            return (self.buffer[idx:idx + length],)
+        return (self.buffer[idx:self.buf_size], self.buffer[:idx + length - self.buf_size])
+
+
+class MirroredCircularBuffer(CircularBuffer):
+    """
+    CircularBuffer with the first mirror_length frames duplicated past the end of the buffer.
+
+    Any read of up to mirror_length frames is then a contiguous view, so get_view() never copies.
+    put() keeps the mirrored frames up to date.
+    """
+
+    def __init__(self, shape: tuple = (0, 0), buffer=None, mirror_length=0):
+        if buffer is None:
+            buffer = np.zeros(shape)
+
+        buf_size = np.shape(buffer)[0]
+        if mirror_length > buf_size:
+            raise ValueError("mirror length is larger than circular buffer")
+
+        # copy the data into a larger array with room for the mirror
+        data = np.zeros((buf_size + mirror_length, *np.shape(buffer)[1:]), dtype=buffer.dtype)
+        data[:buf_size] = buffer
+        data[buf_size:] = buffer[:mirror_length]
+
+        super().__init__(buffer=data)
+        self.buf_size = buf_size
+        self.mirror_length = mirror_length
+
+    @classmethod
+    def from_mirrored(cls, buffer: np.ndarray, mirror_length):
+        """Wrap an array that already holds the mirrored frames at its end, without copying it"""
+        self = cls.__new__(cls)
+        CircularBuffer.__init__(self, buffer=buffer)
+        self.buf_size = np.shape(buffer)[0] - mirror_length
+        self.mirror_length = mirror_length
+        return self
+
+    def _update_mirror(self, start, stop):
+        # copy any written frames that are mirrored past the end
+        if start < self.mirror_length:
+            stop = min(stop, self.mirror_length)
+            self.buffer[self.buf_size + start:self.buf_size + stop] = self.buffer[start:stop]
+
+    def put(self, idx, data: np.ndarray, length=None) -> int:
+        if length is None:
+            length = np.shape(data)[0]
+
+        next_idx = super().put(idx, data, length=length)
+
+        if idx + length >= self.buf_size:
+            self._update_mirror(idx, self.buf_size)
+            self._update_mirror(0, next_idx)
+        else:
+            self._update_mirror(idx, next_idx)
+
+        return next_idx
+
+    def get_view(self, idx, length, scratch: np.ndarray = None):
+        if length <= self.mirror_length:
+            return (idx + length) % self.buf_size, self.buffer[idx: idx + length]
+
+        return super().get_view(idx, length, scratch=scratch)
@@ -0,0 +1,65 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def design_lowpass(num_taps, cutoff) -> np.ndarray:
+    """Windowed sinc lowpass FIR filter. cutoff is a fraction of the sample rate (0 - 0.5)"""
+    n = np.arange(num_taps) - (num_taps - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(num_taps)
+    return taps / np.sum(taps)
+
+
+class Decimator(object):
+    """
+    Streaming polyphase decimation of mono audio by an integer factor
+
+    Only every factor-th output of the anti aliasing filter is computed, and the filter
+    history is carried between blocks so blocks of any size give the same result as one long block.
+    Everything is preallocated for blocks of up to max_frames.
+    """
+
+    def __init__(self, factor, max_frames=1024, taps_per_phase=8, dtype=np.float32):
+        if factor < 1:
+            raise ValueError("decimation factor must be at least 1")
+
+        self.factor = factor
+        self.max_frames = max_frames
+
+        # cut off a bit below the new nyquist frequency
+        num_taps = taps_per_phase * factor + 1
+        self.filter = design_lowpass(num_taps, 0.45 / factor).astype(dtype)[::-1].copy()
+        self.history = num_taps - 1
+
+        # filter history followed by the newest block
+        self.buffer = np.zeros(self.history + max_frames, dtype=dtype)
+        self.output = np.zeros(max_frames // factor + 1, dtype=dtype)
+
+        # index in the next block of the next output sample
+        self.phase = 0
+
+    def get_output_length(self, num_frames) -> int:
+        """Number of output samples the next process() call will return for num_frames of input"""
+        return max(0, (num_frames - self.phase + self.factor - 1) // self.factor)
+
+    def process(self, block: np.ndarray, output: np.ndarray = None) -> np.ndarray:
+        """Returns the decimated block as a view into output (or self.output if None)"""
+        frames = block.shape[0]
+        if frames > self.max_frames:
+            raise ValueError("block is larger than the decimator's max_frames")
+        if output is None:
+            output = self.output
+
+        history = self.history
+        self.buffer[history:history + frames] = block
+
+        # each window ends on the input sample of one output sample
+        count = self.get_output_length(frames)
+        windows = sliding_window_view(self.buffer[:history + frames], history + 1)
+        output = output[:count]
+        np.matmul(windows[self.phase:frames:self.factor], self.filter, out=output)
+
+        self.phase += count * self.factor - frames
+
+        # keep the newest samples as the history for the next block
+        self.buffer[:history] = self.buffer[frames:frames + history]
+        return output
@@ -0,0 +1,41 @@
+import numpy as np
+
+
+class Downmix(object):
+    """
+    Downmixes multichannel blocks to mono without allocating
+
+    The mono block is written into a caller supplied output array, or into an array preallocated here.
+    channel weights default to an equal mix (the same as librosa.to_mono).
+    """
+
+    def __init__(self, channels, max_frames=1024, weights=None, dtype=np.float32):
+        if weights is None:
+            weights = np.full(channels, 1 / channels)
+
+        self.weights = np.asarray(weights, dtype=dtype)
+        if self.weights.shape != (channels,):
+            raise ValueError(f"expected {channels} channel weights but got {self.weights.shape}")
+
+        self.channels = channels
+        self.output = np.zeros(max_frames, dtype=dtype)
+
+    def process(self, block: np.ndarray, output: np.ndarray = None) -> np.ndarray:
+        """Returns the mono version of block as a view into output (or self.output if None)"""
+        frames = block.shape[0]
+        if output is None:
+            # already mono -> nothing to do
+            if block.ndim == 1:
+                return block
+            if frames > self.output.shape[0]:
+                raise ValueError("block is larger than the preallocated downmix output")
+            output = self.output
+
+        output = output[:frames]
+        if block.ndim == 1:
+            output[:] = block
+        elif self.channels == 1 and self.weights[0] == 1:
+            output[:] = block[:, 0]
+        else:
+            np.matmul(block, self.weights, out=output)
+        return output
@@ -1,44 +1,93 @@
-
-"""Load an audio file into memory and play its contents.
+"""Stream an audio file as if it was a real time input stream.
 
 NumPy and the soundfile module (https://PySoundFile.readthedocs.io/)
 must be installed for this to work.
 
-This example program loads the whole file into memory before starting
-playback.
-To play very long files, you should use play_long_file.py instead.
-
+The file is read ahead in a background thread into a ring buffer, so slow storage
+doesn't add jitter to the blocks, and long files are never loaded into memory at once.
 """
-import sounddevice as sd
 import soundfile as sf
 import numpy as np
 import time
 import utils.helpers as utils
-from typing import Callable, Optional
+from typing import Callable
 from threading import Thread, Event
-from utils.circular_buffer import CircularBuffer
+from utils.queue_buffer import LockFreeQueueBuffer
+
+
+# what to do at the end of the file
+FILE_MODES = ("loop", "stop")
 
 
-# TODO: handle wrapping of file
 class InputFileStream(object):
-    def __init__(self, filename, block_size=512, callback: Callable = utils.empty_func):
+    """
+    Calls callback(block, num_frames) with block_size blocks of the file at the file's sample rate.
+
+    mode "loop" wraps around to the start of the file without a gap, mode "stop" passes the last
+    (zero padded) block and then stops. start is the offset in seconds to start streaming from,
+    and seek() jumps while streaming. Blocks are always (block_size, channels), even for mono files.
+
+    A reader thread keeps up to read_ahead blocks read from the file. If it falls behind, silent
+    blocks are passed instead and counted in underruns, like a real audio device would.
+    """
+
+    def __init__(self, filename, block_size=512, callback: Callable = utils.empty_func, mode="loop", start=0.0,
+                 read_ahead=16, read_size=None):
+        if mode not in FILE_MODES:
+            raise ValueError(f"unknown mode {mode}, expected one of {FILE_MODES}")
+
         self.filename = filename
         self.block_size = block_size
         self.callback = callback
+        self.mode = mode
 
         self.file = sf.SoundFile(filename)
         self.sample_rate = self.file.samplerate
         self.channels = self.file.channels
+        self.frames = self.file.frames
         self.latency = self.block_size / self.sample_rate
+        if self.frames == 0:
+            raise ValueError(f"{filename} has no audio")
+
+        # the file is read in read_size chunks into the ring -> always room for at least two
+        self.read_size = 4 * block_size if read_size is None else read_size
+        capacity = max(read_ahead * block_size, 2 * self.read_size)
+        self.ring = LockFreeQueueBuffer((capacity, self.channels), poll_interval=self.latency / 4)
+        self.chunk = np.zeros((self.read_size, self.channels), dtype=np.float32)
+        self.block = np.zeros((block_size, self.channels), dtype=np.float32)
+
+        # seeks are done by the reader thread -> seek_idx is the ring index where the new position starts,
+        # published once the first chunk from there is in the ring
+        self.seek_frame = int(start * self.sample_rate) % self.frames
+        self.seek_idx = 0
+        self.end_idx = None  # ring index of the end of the file in stop mode, once it is read
 
         self.start_event = Event()
+        self.wake_event = Event()
 
         self.blocks_received = 0
+        self.underruns = 0
+        self.reader = None
+        self.thread = None
         self._stop = False
 
+    @property
+    def active(self):
+        return self.thread is not None and self.thread.is_alive()
+
     def start(self):
         self._stop = False
         self.start_event.clear()
+
+        if self.reader is not None:
+            self.reader.join()  # the reader of the last start() is stopping
+        self.reader = Thread(target=self._read_file, daemon=True)
+        self.reader.start()
+
+        # fill the ring before the first block
+        while self.ring.size() < min(self.read_size, self.ring.capacity) and self.end_idx is None:
+            self.ring._wait()
+
         self.thread = Thread(target=self._stream_file)
         self.thread.start()
 
@@ -47,50 +96,112 @@ class InputFileStream(object):
 
     def stop(self):
         self._stop = True
+        self.wake_event.set()
 
     def abort(self):
-        self._stop = True
+        self.stop()
+
+    def seek(self, seconds):
+        """Continue from seconds into the file -> blocks already read ahead are dropped"""
+        self.seek_frame = int(seconds * self.sample_rate) % self.frames
+        self.wake_event.set()
+
+    def _read_chunk(self) -> int:
+        """Fill self.chunk from the file, wrapping around in loop mode. Returns the frames read"""
+        filled = 0
+        while filled < self.read_size:
+            num_frames = self.file.read(frames=self.read_size - filled, dtype="float32", always_2d=True,
+                                        out=self.chunk[filled:]).shape[0]
+            filled += num_frames
+
+            # end of the file
+            if filled < self.read_size:
+                if self.mode != "loop":
+                    break
+                self.file.seek(0)
+        return filled
+
+    def _read_file(self):
+        """THREAD: reads the file ahead of the stream into the ring"""
+        ring = self.ring
+        seeking = False
+        while not self._stop:
+            seek_frame = self.seek_frame
+            if seek_frame is not None:
+                self.seek_frame = None
+                self.file.seek(seek_frame)
+                self.end_idx = None
+                seeking = True
+
+            # stop mode and the whole file is read -> wait for a seek or stop
+            if self.end_idx is not None:
+                self.wake_event.wait()
+                self.wake_event.clear()
+                continue
+
+            # wait for room for another chunk
+            if ring.capacity - ring.size() < self.read_size:
+                ring._wait()
+                continue
+
+            num_frames = self._read_chunk()
+            chunk_idx = ring.write_idx
+            ring.put_nowait(self.chunk, length=num_frames)
+            if seeking:
+                # publish once the new position is in the ring -> the stream goes straight from the old audio to it
+                self.seek_idx = chunk_idx
+                seeking = False
+            if num_frames < self.read_size:
+                self.end_idx = ring.write_idx
 
     def _stream_file(self):
         """THREAD: Imitates real time audio stream but from file"""
+        ring = self.ring
         time_per_loop = (self.block_size / self.sample_rate)
         extra_time_slept = 0
         while not self._stop:
             start = time.perf_counter()
 
-            # process the audio
-            block = self.file.read(frames=self.block_size, dtype='float32')
-            num_frames = np.shape(block)[0]
-
-            # handle mono
-            if block.ndim == 1:
-                block = np.expand_dims(block, axis=1)
-
-            # handle end of file
-            if num_frames < self.block_size:
-                new_block = np.zeros((self.block_size, block.shape[1]), dtype=np.float32)
-                new_block[:num_frames] = block
-                block = new_block
-                self.file.seek(0)
+            # drop whatever was read ahead before the last seek
+            seek_idx = self.seek_idx
+            if seek_idx > ring.read_idx:
+                ring.read_idx = seek_idx
+
+            # get the next block from the ring
+            end_idx = self.end_idx
+            if end_idx is not None and end_idx - ring.read_idx <= self.block_size:
+                # the last block of the file -> zero padded
+                num_frames = end_idx - ring.read_idx
+                ring.get_into_nowait(self.block, length=num_frames)
+                self.block[num_frames:] = 0
+                self._stop = True
+            elif ring.get_into_nowait(self.block):
+                num_frames = self.block_size
+            else:
+                # the reader fell behind -> silence instead of waiting
+                self.block[:] = 0
+                num_frames = self.block_size
+                self.underruns += 1
 
             self.blocks_received += num_frames
-            self.callback(block, num_frames)
+            self.callback(self.block, num_frames)
 
             # compute processing time
             end_compute = time.perf_counter()
             elapsed_compute = end_compute - start
-            # print(f"input process time: {elapsed_compute}")
 
             # sleep for remaining time at given sample rate
             sleep_time = time_per_loop - elapsed_compute - extra_time_slept
-            # print(f"Sleep time: {sleep_time}")
             time.sleep(max(0, sleep_time))
 
             # signal first block done
-            if self.blocks_received <= self.block_size and self.blocks_received > 0:
-                self.start_event.set()
+            self.start_event.set()
 
             # record any excess time spent sleeping to remove in the next loop
             end_sleep = time.perf_counter()
             elapsed_sleep = end_sleep - end_compute
             extra_time_slept = elapsed_sleep - sleep_time
+
+        # wake anything waiting on the stream or reader if it stopped at the end of the file
+        self.start_event.set()
+        self.wake_event.set()
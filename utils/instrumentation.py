@@ -0,0 +1,177 @@
+import csv
+import json
+import time
+import numpy as np
+from pathlib import Path
+from threading import Thread, Event
+
+
+# upper edges of the execution time histogram bins in microseconds (last bin is everything above)
+HISTOGRAM_EDGES_US = [50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000]
+
+# sounddevice CallbackFlags attributes that are counted
+STATUS_FLAGS = ["input_underflow", "input_overflow", "output_underflow", "output_overflow", "priming_output"]
+
+
+class CallbackMonitor(object):
+    """
+    Low overhead timing of a stream callback (or any other block processing loop)
+
+    Call start() at the top of the callback and stop() at the end. Everything is written into
+    preallocated arrays holding the last `history` calls, so nothing allocates on the real time side.
+    snapshot() summarizes these from another thread.
+    """
+
+    def __init__(self, name, sample_rate, buffer=None, history=4096):
+        self.name = name
+        self.sample_rate = sample_rate
+        self.buffer = buffer  # QueueBuffer whose fill level is recorded
+        self.history = history
+
+        self.exec_times = np.zeros(history)
+        self.slack = np.zeros(history)
+        self.fill = np.zeros(history)
+
+        self.count = 0
+        self.late = 0
+        self.underflows = 0
+        self.status_counts = {flag: 0 for flag in STATUS_FLAGS}
+
+    def start(self) -> float:
+        return time.perf_counter()
+
+    def underflow(self):
+        self.underflows += 1
+
+    def stop(self, start, frames, status=None):
+        elapsed = time.perf_counter() - start
+        slack = frames / self.sample_rate - elapsed
+
+        i = self.count % self.history
+        self.exec_times[i] = elapsed
+        self.slack[i] = slack
+        if self.buffer is not None:
+            self.fill[i] = self.buffer.size()
+
+        if slack < 0:
+            self.late += 1
+
+        if status:
+            for flag in STATUS_FLAGS:
+                if getattr(status, flag, False):
+                    self.status_counts[flag] += 1
+
+        self.count += 1
+
+    def snapshot(self) -> dict:
+        n = min(self.count, self.history)
+        exec_us = self.exec_times[:n] * 1e6
+        slack_us = self.slack[:n] * 1e6
+        fill = self.fill[:n]
+
+        snapshot = {
+            "name": self.name,
+            "count": self.count,
+            "late": self.late,
+            "underflows": self.underflows,
+            **self.status_counts,
+            "histogram_edges_us": HISTOGRAM_EDGES_US,
+            "histogram": np.bincount(np.searchsorted(HISTOGRAM_EDGES_US, exec_us),
+                                     minlength=len(HISTOGRAM_EDGES_US) + 1).tolist(),
+        }
+        if n == 0:
+            exec_us = slack_us = fill = np.full(1, np.nan)
+
+        snapshot.update({
+            "exec_p50_us": float(np.percentile(exec_us, 50)),
+            "exec_p99_us": float(np.percentile(exec_us, 99)),
+            "exec_max_us": float(np.max(exec_us)),
+            "slack_min_us": float(np.min(slack_us)),
+            "fill_min": float(np.min(fill)),
+            "fill_mean": float(np.mean(fill)),
+            "fill_max": float(np.max(fill)),
+        })
+        return snapshot
+
+
+class NullCallbackMonitor(CallbackMonitor):
+    """Does nothing -> used when instrumentation is disabled"""
+
+    def __init__(self, name="", *args, **kwargs):
+        self.name = name
+
+    def start(self) -> float:
+        return 0.0
+
+    def underflow(self):
+        pass
+
+    def stop(self, start, frames, status=None):
+        pass
+
+    def snapshot(self) -> dict:
+        return {"name": self.name}
+
+
+class Instrumentation(object):
+    """
+    Collection of CallbackMonitors that can be periodically dumped to a .json (JSON lines) or .csv file
+
+    When not enabled, add() returns NullCallbackMonitors so the callbacks don't need to check.
+    """
+
+    def __init__(self, enabled=True, history=4096):
+        self.enabled = enabled
+        self.history = history
+        self.monitors = []
+
+        self._stop = Event()
+        self.thread = None
+
+    def add(self, name, sample_rate, buffer=None) -> CallbackMonitor:
+        if not self.enabled:
+            return NullCallbackMonitor(name)
+
+        monitor = CallbackMonitor(name, sample_rate, buffer=buffer, history=self.history)
+        self.monitors.append(monitor)
+        return monitor
+
+    def snapshot(self) -> list:
+        timestamp = time.time()
+        return [{"time": timestamp, **monitor.snapshot()} for monitor in self.monitors]
+
+    def dump(self, filename):
+        """Append the current snapshot to the given .json or .csv file"""
+        snapshot = self.snapshot()
+        if Path(filename).suffix == ".csv":
+            write_header = not Path(filename).exists()
+            with open(filename, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=list(snapshot[0].keys()) if snapshot else [],
+                                        extrasaction="ignore")
+                if write_header:
+                    writer.writeheader()
+                writer.writerows(snapshot)
+        else:
+            with open(filename, "a") as f:
+                for row in snapshot:
+                    f.write(json.dumps(row) + "\n")
+
+    def start_dumping(self, filename, interval=1.0):
+        """Dump every interval seconds from a background thread"""
+        if not self.enabled:
+            return
+
+        def dump_thread():
+            while not self._stop.wait(interval):
+                self.dump(filename)
+            self.dump(filename)
+
+        self._stop.clear()
+        self.thread = Thread(target=dump_thread, daemon=True)
+        self.thread.start()
+
+    def stop_dumping(self):
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,116 @@
+import json
+import numpy as np
+from pathlib import Path
+from utils.beat_detector import BeatDetector
+
+
+class LatencyBudget(object):
+    """
+    Latency in seconds of every fixed stage between a beat on the input and the loop audio heard for it
+
+        input        audio device input latency (reported by the stream)
+        output       loop output latency (reported by the stream)
+        detection    how late the beat tracker timestamps a beat (measured by calibrate_latency.py)
+        calibration  measured round trip minus the reported input and output latency
+
+    The stages that change every block (the stretcher latency and the stretched audio already queued)
+    are added by LoopTrack and BeatSync. Load a profile saved by calibrate_latency.py with from_file(),
+    then set_streams() with the latency of the streams that are actually opened. With a measured
+    round_trip, calibration is whatever of it those streams don't report, so nothing is counted twice.
+    """
+
+    STAGES = ("input", "output", "detection", "calibration")
+
+    def __init__(self, input=0.0, output=0.0, detection=0.0, calibration=0.0,  # pylint: disable=redefined-builtin
+                 round_trip=None):
+        self.input = input
+        self.output = output
+        self.detection = detection
+        self.calibration = calibration
+        self.round_trip = round_trip
+        if round_trip is not None:
+            self.set_streams(input, output)
+
+    def set_streams(self, input, output):  # pylint: disable=redefined-builtin
+        """Set the reported input and output stream latency"""
+        self.input = input
+        self.output = output
+        if self.round_trip is not None:
+            self.calibration = self.round_trip - input - output
+
+    def total(self) -> float:
+        return sum(getattr(self, stage) for stage in self.STAGES)
+
+    def to_dict(self) -> dict:
+        return {stage: float(getattr(self, stage)) for stage in self.STAGES}
+
+    def save(self, filename, **extra):
+        """Save the stages, the round trip and any extra measurements as json"""
+        with open(filename, "w") as f:
+            json.dump({**self.to_dict(), "round_trip": self.round_trip, **extra}, f, indent=2)
+
+    @classmethod
+    def from_file(cls, filename):
+        if not Path(filename).exists():
+            raise FileNotFoundError(filename)
+
+        with open(filename, "r") as f:
+            data = json.load(f)
+        return cls(round_trip=data.get("round_trip"), **{stage: data.get(stage, 0.0) for stage in cls.STAGES})
+
+    def print_stages(self):
+        for stage in self.STAGES:
+            print(f"{stage + ' latency':<22}{getattr(self, stage) * 1e3:>8.2f} ms")
+        print(f"{'total latency':<22}{self.total() * 1e3:>8.2f} ms")
+
+
+def make_click_track(sample_rate, seconds, tempo=120.0, click_length=64) -> tuple:
+    """Mono track of short clicks on every beat. Returns the track and the sample index of every click"""
+    track = np.zeros(int(sample_rate * seconds), dtype=np.float32)
+    clicks = np.arange(0, track.shape[0] - click_length, sample_rate * 60 / tempo).astype(np.int64)
+
+    # a decaying burst at 1 kHz is easy to pick out of a noisy recording
+    t = np.arange(click_length) / sample_rate
+    click = (np.sin(2 * np.pi * 1000 * t) * np.exp(-t * sample_rate / (click_length / 4))).astype(np.float32)
+    for start in clicks:
+        track[start:start + click_length] = click
+    return track, clicks
+
+
+def measure_round_trip(recording: np.ndarray, track: np.ndarray, max_delay) -> int:
+    """Delay in samples of the click track in the (mono) recording, from 0 to max_delay samples"""
+    length = recording.shape[0] + track.shape[0]
+    n = int(2 ** np.ceil(np.log2(length)))
+    correlation = np.fft.irfft(np.fft.rfft(recording, n) * np.conj(np.fft.rfft(track, n)), n)
+    return int(np.argmax(correlation[:max_delay + 1]))
+
+
+def measure_detection_delay(recording: np.ndarray, sample_rate, clicks: np.ndarray, tempo=120.0, block_size=1024,
+                            hop_size=None, analysis_rate=None, warmup=4.0) -> float:
+    """
+    Median delay in samples between each click in the (mono) recording and the beat the BeatDetector
+    timestamps for it. clicks are where the clicks are in the recording (so include the round trip).
+    The first warmup seconds are ignored while the tracker locks on.
+    """
+    detector = BeatDetector(sample_rate, block_size=block_size, hop_size=hop_size, fixed_tempo=tempo, verbose=False,
+                            channels=1, analysis_rate=analysis_rate)
+
+    beats = []
+    block = np.zeros((block_size, 1), dtype=np.float32)
+    for start in range(0, recording.shape[0] - block_size, block_size):
+        block[:, 0] = recording[start:start + block_size]
+        if detector.process(block):
+            beats.append(detector.last_beat_sample)
+
+    beat_length = sample_rate * 60 / tempo
+    delays = []
+    for beat in beats:
+        if beat < warmup * sample_rate:
+            continue
+        # delay after the nearest click, wrapped into (-half a beat, half a beat]
+        delay = beat - clicks[np.argmin(np.abs(clicks - beat))]
+        delays.append((delay + beat_length / 2) % beat_length - beat_length / 2)
+
+    if len(delays) == 0:
+        raise RuntimeError("no beats were detected in the recording")
+    return float(np.median(delays))
@@ -0,0 +1,256 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from utils.audio_loop import AudioLoop
+from utils.beat_sync import BeatSync
+from utils.queue_buffer import QueueBuffer
+from utils.stretcher import create_stretcher, resolve_stretcher
+from utils.stretch_cache import StretchCache
+
+
+def mix_into(output: np.ndarray, data: np.ndarray, gain=1.0, scratch: np.ndarray = None):
+    """
+    Add data into output, spreading mono data across all output channels.
+    Any gain other than 1 is applied in scratch (a 1d array of at least data.size) -> nothing is allocated
+    """
+    if gain != 1.0:
+        if scratch is None:
+            scratch = np.empty(data.size, dtype=data.dtype)
+        data = np.multiply(data, gain, out=scratch[:data.size].reshape(data.shape))
+
+    if data.shape[1] == output.shape[1]:
+        output += data
+    else:
+        # a channel at a time -> numpy allocates a buffer to broadcast or slice the channels of a 2d block
+        mono = data.shape[1] == 1
+        for channel in range(output.shape[1] if mono else min(data.shape[1], output.shape[1])):
+            output[:, channel] += data[:, 0 if mono else channel]
+
+
+class LoopTrack(object):
+    """
+    One AudioLoop with its own stretcher and beat sync.
+
+    Stretched audio is kept in a small queue so that exactly the requested number of frames
+    can be mixed each block, no matter how much the stretcher outputs at once.
+    Whatever doesn't fit stays in the stretcher and is drained before any more of the loop is stretched,
+    so big time_scales (a slowed loop) just take fewer loop blocks instead of overflowing the queue.
+
+    With a StretchCache, blocks are copied from the loop pre rendered at the current time_scale
+    whenever the cache covers it (see StretchCache.covers), which is where the beat corrections stay once the
+    loop is locked to a steady input. Bigger corrections are stretched live.
+    """
+
+    def __init__(self, loop: AudioLoop, block_size, input_sample_rate, gain=1.0, verbose=True, stretcher="auto",
+                 cache: StretchCache = None):
+        self.loop = loop
+        self.block_size = block_size
+        self.input_sample_rate = input_sample_rate
+        self.gain = gain
+        self.verbose = verbose
+
+        loop.use_mirrored_buffer(block_size)  # every block read is a view -> no copies
+        self.stretcher_name = resolve_stretcher(stretcher)
+        self.stretcher = create_stretcher(self.stretcher_name, sample_rate=loop.sample_rate, channels=loop.channels)
+        self.sync = None
+
+        # pre rendered loops
+        self.cache = cache
+        self.live = True  # False while blocks come from the cache
+        self.discard = 0  # stretched frames to drop after restarting the stretcher
+        self.loop_remainder = 0.0  # fraction of a loop sample the cache has moved past the loop position
+        self.cached_blocks = 0
+        self.live_blocks = 0
+
+        # stretched audio waiting to be mixed -> the stretcher output is drained straight into it
+        self.buffer = QueueBuffer((16 * block_size, loop.channels))
+        self.scratch = np.zeros((block_size, loop.channels), dtype=np.float32)  # for discarded output
+        self.mix_scratch = np.zeros(block_size * loop.channels, dtype=np.float32)  # for applying the gain
+
+    def start(self, tempo):
+        self.sync = BeatSync(self.loop, self.input_sample_rate, tempo, verbose=self.verbose)
+        if self.cache is not None:
+            self.cache.prefetch([self.sync.time_scale])
+
+    def on_input_beat(self, tempo, samples_since_last_input_beat, queued_samples, latency_seconds):
+        # this latency is in seconds, the stretcher latency is in samples
+        latency = latency_seconds * self.loop.sample_rate + self.stretcher.get_latency()
+        self.sync.on_input_beat(tempo, samples_since_last_input_beat, queued_samples + self.buffer.size(), latency)
+
+    def on_block(self, tempo, samples_since_last_input_beat):
+        self.sync.on_block(tempo, samples_since_last_input_beat)
+
+    def fill(self, num_frames):
+        """Stretch the loop until at least num_frames are ready"""
+        while self.buffer.size() < num_frames:
+            if self.live and self.stretcher.available() > 0:
+                # stretched audio that didn't fit last time comes first
+                self._drain()
+                continue
+
+            rendered = self._get_rendered()
+            if rendered is not None:
+                self._fill_from_cache(rendered)
+                self.cached_blocks += 1
+            else:
+                self._fill_live()
+                self.live_blocks += 1
+
+    def _get_rendered(self):
+        # once locked to a steady input the beat corrections stay near the tempo ratio -> a few renders cover them
+        if self.cache is None or not self.cache.covers(self.sync.time_scale, self.sync.tempo_scale):
+            return None
+        return self.cache.get(self.sync.time_scale)
+
+    def _fill_from_cache(self, rendered: np.ndarray):
+        if self.live:
+            # the stretcher still holds loop audio it hasn't output -> continue from the start of it
+            self.loop.skip(-int(self.stretcher.get_latency()))
+            self.loop_remainder = 0.0
+            self.live = False
+
+        # copy up to a block from the same position in the rendered loop, stopping at its end
+        ratio = rendered.shape[0] / self.loop.samples
+        start = int(round((self.loop.buf_idx + self.loop_remainder) * ratio)) % rendered.shape[0]
+        num_frames = min(self.block_size, rendered.shape[0] - start)
+        self.buffer.put_nowait(rendered[start:start + num_frames])
+
+        # move the loop along by as much loop audio as was copied
+        position = self.loop_remainder + num_frames / ratio
+        self.loop.skip(int(position))
+        self.loop_remainder = position - int(position)
+
+    def _fill_live(self):
+        if not self.live:
+            # restart the stretcher a bit before the loop position and drop what it outputs for the preroll
+            self.stretcher.reset()
+            self.discard = int(round(self.cache.preroll * self.sync.time_scale)) + int(self.stretcher.get_latency())
+            self.loop.skip(-self.cache.preroll)
+            self.live = True
+
+        self.stretcher.set_time_ratio(self.sync.time_scale)
+        self.stretcher.process(self.loop.get_next_block_view(self.block_size), False)
+        self._drain()
+
+    def _drain(self):
+        """Retrieve the stretched audio straight into the free space of the buffer, leaving the rest in the stretcher"""
+        while self.discard > 0:
+            skipped = self.stretcher.retrieve_into(self.scratch[:self.discard])
+            if skipped == 0:
+                return
+            self.discard -= skipped
+
+        available = self.stretcher.available()
+        while available > 0:
+            free = min(available, self.buffer.capacity - self.buffer.size())
+            if free == 0:
+                return
+
+            # one or two regions, depending on whether the free space wraps around
+            written = 0
+            for region in self.buffer.write_regions_nowait(free):
+                written += self.stretcher.retrieve_into(region)
+            self.buffer.commit_write(written)
+            available = self.stretcher.available()
+
+    def mix_into(self, output: np.ndarray):
+        frames = output.shape[0]
+        self.fill(frames)
+        if frames * self.loop.channels > self.mix_scratch.shape[0]:
+            self.mix_scratch = np.zeros(frames * self.loop.channels, dtype=np.float32)
+
+        # mix straight from the buffer
+        start = 0
+        for region in self.buffer.read_regions_nowait(frames):
+            mix_into(output[start:start + region.shape[0]], region, gain=self.gain, scratch=self.mix_scratch)
+            start += region.shape[0]
+        self.buffer.commit_read(frames)
+
+
+class LoopEngine(object):
+    """
+    Syncs and mixes any number of AudioLoops against one input.
+
+    The beat detection is done once (outside of this) and passed to every loop's BeatSync.
+    Each loop gets its own stretcher and everything is mixed into one output block.
+    All loops must have the same sample rate.
+
+    With workers > 0 the loops are stretched in parallel on a pool of threads, and every loop
+    is finished before anything is mixed, so the output is the same as stretching them serially.
+    This only helps if the stretcher releases the GIL while it works.
+
+    stretcher is the name of the time stretch backend to use (see utils/stretcher.py).
+    With cache_bytes > 0 each loop gets a StretchCache of that many bytes, rendering ratios rounded to cache_step.
+    """
+
+    def __init__(self, loops: list, block_size, input_sample_rate, gains=None, verbose=True, workers=0,
+                 stretcher="auto", cache_bytes=0, cache_step=0.005, cache_background=True):
+        if len(loops) == 0:
+            raise ValueError("at least one loop is required")
+        if gains is None:
+            gains = [1.0] * len(loops)
+        if len(gains) != len(loops):
+            raise ValueError(f"got {len(gains)} gains for {len(loops)} loops")
+
+        self.sample_rate = loops[0].sample_rate
+        if any(loop.sample_rate != self.sample_rate for loop in loops):
+            raise ValueError("all loops must have the same sample rate")
+
+        self.block_size = block_size
+        self.channels = max(loop.channels for loop in loops)
+        stretcher = resolve_stretcher(stretcher)
+        self.caches = [None] * len(loops)
+        if cache_bytes > 0:
+            self.caches = [StretchCache(loop, stretcher=stretcher, step=cache_step, max_bytes=cache_bytes,
+                                        background=cache_background) for loop in loops]
+
+        self.tracks = [LoopTrack(loop, block_size, input_sample_rate, gain=gain, verbose=verbose, stretcher=stretcher,
+                                 cache=cache) for loop, gain, cache in zip(loops, gains, self.caches)]
+
+        self.pool = None
+        if workers > 0 and len(self.tracks) > 1:
+            self.pool = ThreadPoolExecutor(max_workers=min(workers, len(self.tracks)),
+                                           thread_name_prefix="stretch")
+
+    @property
+    def tempo(self):
+        """Tempo of the first loop"""
+        return self.tracks[0].loop.tempo
+
+    def start(self, tempo):
+        for track in self.tracks:
+            track.start(tempo)
+
+    def on_input_beat(self, tempo, samples_since_last_input_beat, queued_samples=0, latency_seconds=0.0):
+        """queued_samples are mixed samples already waiting to be played (eg in the output buffer)"""
+        for track in self.tracks:
+            track.on_input_beat(tempo, samples_since_last_input_beat, queued_samples, latency_seconds)
+
+    def on_block(self, tempo, samples_since_last_input_beat):
+        for track in self.tracks:
+            track.on_block(tempo, samples_since_last_input_beat)
+
+    def process_into(self, regions):
+        """process() into the write regions of a queue (see QueueBuffer.write_regions)"""
+        for region in regions:
+            self.process(region)
+
+    def process(self, output: np.ndarray):
+        """Stretch every loop and mix the next output.shape[0] frames into output"""
+        if self.pool is not None:
+            futures = [self.pool.submit(track.fill, output.shape[0]) for track in self.tracks]
+            # wait for every loop before mixing -> result() also raises any errors from the workers
+            for future in futures:
+                future.result()
+
+        # always mix in the same order so the output is deterministic
+        output[:] = 0
+        for track in self.tracks:
+            track.mix_into(output)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        for cache in self.caches:
+            if cache is not None:
+                cache.close()
@@ -0,0 +1,109 @@
+"""
+Binary AudioLoop file format
+
+    preamble   magic, version, metadata length, beat table offset, audio offset (little endian)
+    metadata   utf-8 json of the AudioLoop attributes
+    beats      int64 beat frames
+    audio      raw PCM, (samples + mirror_frames, channels), page aligned
+
+The first mirror_frames of the audio are repeated after its end, so a memory mapped loop can be
+read as a MirroredCircularBuffer without copying anything. Nothing is unpickled when loading.
+"""
+import json
+import struct
+import numpy as np
+from pathlib import Path
+
+
+MAGIC = b"AUDLOOP\x00"
+VERSION = 1
+PREAMBLE = struct.Struct("<8sIIQQ")
+PAGE_SIZE = 4096
+
+# default number of frames mirrored past the end of the audio (the largest block size we use)
+DEFAULT_MIRROR_FRAMES = 8192
+
+
+def _align(offset, alignment) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def is_loop_file(filename) -> bool:
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def save_loop_file(filename, data: dict, mirror_frames=DEFAULT_MIRROR_FRAMES):
+    """Save the AudioLoop data dict (the same dict that used to be pickled)"""
+    audio = np.ascontiguousarray(data["audio"])
+    samples = audio.shape[0]
+    mirror_frames = min(mirror_frames, samples)
+    beat_frames = np.rint(np.asarray(data["beat_frames"])).astype("<i8")
+
+    metadata = {
+        "sample_rate": int(data["sample_rate"]),
+        "tempo": float(np.squeeze(data["tempo"])),
+        "block_size": int(data["block_size"]),
+        "hop_length": int(data["hop_length"]),
+        "samples": int(samples),
+        "channels": int(audio.shape[1]),
+        "num_frames_adjusted": int(data["num_frames_adjusted"]),
+        "num_beats": int(beat_frames.shape[0]),
+        "dtype": audio.dtype.str,
+        "mirror_frames": int(mirror_frames),
+    }
+    metadata_bytes = json.dumps(metadata).encode("utf-8")
+
+    beat_offset = _align(PREAMBLE.size + len(metadata_bytes), 8)
+    audio_offset = _align(beat_offset + beat_frames.nbytes, PAGE_SIZE)
+
+    with open(filename, "wb") as f:
+        f.write(PREAMBLE.pack(MAGIC, VERSION, len(metadata_bytes), beat_offset, audio_offset))
+        f.write(metadata_bytes)
+        f.seek(beat_offset)
+        f.write(beat_frames.tobytes())
+        f.seek(audio_offset)
+        f.write(audio.tobytes())
+        f.write(audio[:mirror_frames].tobytes())
+
+
+def load_loop_file(filename, mmap=True) -> dict:
+    """
+    Load the AudioLoop data dict from the given file.
+    With mmap the audio is a read only np.memmap, so loading takes the same time for any loop length
+    and the pages are shared between processes.
+    """
+    if not Path(filename).exists():
+        raise FileNotFoundError(filename)
+
+    with open(filename, "rb") as f:
+        magic, version, metadata_length, beat_offset, audio_offset = PREAMBLE.unpack(f.read(PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not an AudioLoop file")
+        if version > VERSION:
+            raise ValueError(f"{filename} has unsupported AudioLoop file version {version}")
+
+        metadata = json.loads(f.read(metadata_length).decode("utf-8"))
+        f.seek(beat_offset)
+        beat_frames = np.frombuffer(f.read(8 * metadata["num_beats"]), dtype="<i8").astype(np.int64)
+
+        shape = (metadata["samples"] + metadata["mirror_frames"], metadata["channels"])
+        if mmap:
+            mirrored_audio = np.memmap(f, dtype=metadata["dtype"], mode="r", offset=audio_offset, shape=shape)
+        else:
+            f.seek(audio_offset)
+            mirrored_audio = np.fromfile(f, dtype=metadata["dtype"], count=shape[0] * shape[1]).reshape(shape)
+
+    return {
+        "audio": mirrored_audio[:metadata["samples"]],
+        "mirrored_audio": mirrored_audio,
+        "mirror_frames": metadata["mirror_frames"],
+        "sample_rate": metadata["sample_rate"],
+        "beat_frames": beat_frames,
+        "tempo": metadata["tempo"],
+        "block_size": metadata["block_size"],
+        "hop_length": metadata["hop_length"],
+        "samples": metadata["samples"],
+        "channels": metadata["channels"],
+        "num_frames_adjusted": metadata["num_frames_adjusted"],
+    }
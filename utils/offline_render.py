@@ -0,0 +1,76 @@
+import numpy as np
+import soundfile as sf
+from utils.beat_detector import BeatDetector
+from utils.loop_engine import LoopEngine, mix_into
+
+
+def render_offline(loops: list, input_path, output_path, block_size=1024, input_gain=0.5, loop_start=0.0,
+                   gains=None, verbose=False, stretch_workers=0, hop_size=None, analysis_rate=None,
+                   stretcher="auto", stretch_cache=0, cache_step=0.005):
+    """
+    Runs the beat sync pipeline of main.py as fast as possible using the given input file,
+    and writes the input mixed with the stretched loops to output_path.
+
+    loop_start is the time in seconds into the input file when loop playback is requested
+    (the equivalent of pressing enter in main.py). Returns the number of frames written.
+    stretch_cache is the size in MB of each loop's StretchCache (0 disables it). Here the
+    ratios are rendered as soon as they are needed, so the output doesn't depend on timing.
+    """
+    with sf.SoundFile(str(input_path)) as input_file:
+        sample_rate = input_file.samplerate
+        engine = LoopEngine(loops, block_size, sample_rate, gains=gains, verbose=verbose, workers=stretch_workers,
+                            stretcher=stretcher, cache_bytes=int(stretch_cache * 2 ** 20),
+                            cache_step=cache_step, cache_background=False)
+        if sample_rate != engine.sample_rate:
+            raise ValueError(f"input sample rate {sample_rate} does not match loop sample rate {engine.sample_rate}")
+
+        channels = max(input_file.channels, engine.channels)
+        loop_start_frame = int(loop_start * sample_rate)
+
+        # the beat detector object
+        detector = BeatDetector(sample_rate, block_size=block_size, hop_size=hop_size, fixed_tempo=engine.tempo,
+                                verbose=verbose, channels=input_file.channels, analysis_rate=analysis_rate)
+        loops_started = False
+
+        # preallocated blocks
+        input_block = np.zeros((block_size, input_file.channels), dtype=np.float32)
+        gain_block = np.zeros(block_size * input_file.channels, dtype=np.float32)
+        loop_block = np.zeros((block_size, engine.channels), dtype=np.float32)
+        output_block = np.zeros((block_size, channels), dtype=np.float32)
+
+        frames_written = 0
+        with sf.SoundFile(str(output_path), mode="w", samplerate=sample_rate, channels=channels) as output_file:
+            while True:
+                num_frames = input_file.read(frames=block_size, dtype="float32", always_2d=True, out=input_block)
+                num_frames = num_frames.shape[0]
+                if num_frames == 0:
+                    break
+                # zero pad the last block just like InputFileStream
+                input_block[num_frames:] = 0
+
+                beat = detector.process(input_block)
+                output_block[:] = 0
+                mix_into(output_block, input_block, gain=input_gain, scratch=gain_block)
+
+                # wait till the first beat after the requested start to start the loops
+                if not loops_started and frames_written + num_frames > loop_start_frame:
+                    if beat or detector.samples_since_last_beat < 0.3 * (sample_rate * 60 // detector.tempo):
+                        engine.start(detector.tempo)
+                        loops_started = True
+                        beat = False  # this beat was used to start the loops
+
+                if loops_started:
+                    if beat:
+                        engine.on_input_beat(detector.tempo, detector.samples_since_last_beat)
+                    else:
+                        engine.on_block(detector.tempo, detector.samples_since_last_beat)
+
+                    engine.process(loop_block)
+                    mix_into(output_block, loop_block)
+
+                output_file.write(output_block[:num_frames])
+                frames_written += num_frames
+
+        engine.close()
+
+    return frames_written
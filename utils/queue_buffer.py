@@ -1,4 +1,7 @@
 import numpy as np
+import select
+import socket
+import time
 from threading import Event
 from utils.circular_buffer import CircularBuffer
 
@@ -140,7 +143,7 @@ class QueueBuffer(object):
             self.read_event.wait()
             self.read_event.clear()
 
-        output = self.buffer.get(self.read_idx % self.capacity, length)
+        _, output = self.buffer.get(self.read_idx % self.capacity, length)
         self.read_idx += length
         self.read_event.set()
         return output
@@ -149,11 +152,50 @@ class QueueBuffer(object):
         if self.read_idx + length > self.write_idx:
             return None
         else:
-            output = self.buffer.get(self.read_idx % self.capacity, length)
+            _, output = self.buffer.get(self.read_idx % self.capacity, length)
             self.read_idx += length
             self.read_event.set()
             return output
 
+    def write_regions_nowait(self, length):
+        """
+        Views of the next length free frames (two if they wrap around) to write into directly,
+        or None if there isn't room. Call commit_write() once they are written.
+        """
+        if self.write_idx + length - self.read_idx > self.capacity:
+            return None
+        return self.buffer.get_regions(self.write_idx % self.capacity, length)
+
+    def write_regions(self, length):
+        """Like write_regions_nowait() but waits for room"""
+        if length > self.capacity:
+            raise ValueError("given length is larger than queue capacity")
+
+        self.read_event.clear()
+        regions = self.write_regions_nowait(length)
+        while regions is None:
+            self.read_event.wait()
+            self.read_event.clear()
+            regions = self.write_regions_nowait(length)
+        return regions
+
+    def commit_write(self, length):
+        self.write_idx += length
+        self.write_event.set()
+
+    def read_regions_nowait(self, length):
+        """
+        Views of the next length queued frames (two if they wrap around) to read directly,
+        or None if there aren't enough. Call commit_read() once they are used.
+        """
+        if self.read_idx + length > self.write_idx:
+            return None
+        return self.buffer.get_regions(self.read_idx % self.capacity, length)
+
+    def commit_read(self, length):
+        self.read_idx += length
+        self.read_event.set()
+
     # def get_into_force(self, output: np.ndarray, length=None) -> int:
     #     if length is None:
     #         length = np.shape(output)[0]
@@ -178,3 +220,408 @@ class QueueBuffer(object):
 
     #     self.read_event.set()
     #     return output
+
+
+class LockFreeQueueBuffer(QueueBuffer):
+    """
+    Single producer/single consumer QueueBuffer that never takes a lock
+
+    The writer only ever moves write_idx and the reader only ever moves read_idx.
+    Each index is published AFTER the data is copied, so the other side never sees
+    frames that aren't there yet. The _nowait functions never wait or touch an Event,
+    so they are safe to call from audio callbacks.
+
+    The blocking functions poll every poll_interval seconds instead of waiting on events,
+    so only call them from the non real time side!
+
+    With a low_watermark the writer is pull driven instead: write_regions() sleeps until the reader
+    has taken the queue down to low_watermark frames. The read that crosses the watermark wakes the writer
+    by sending one byte on a non blocking socket pair, so the reader still takes no lock and never waits
+    (if the socket is somehow full, the writer is already due to wake up). Call close() to close the sockets.
+    """
+
+    def __init__(self, shape: tuple = (0, 0), buffer=None, poll_interval=0.0005, low_watermark=None):
+        super().__init__(shape, buffer=buffer)
+        self.poll_interval = poll_interval
+        self.low_watermark = low_watermark
+        self.demand_send = None
+        self.demand_recv = None
+        if low_watermark is not None:
+            self._open_demand()
+
+    def _wait(self):
+        time.sleep(self.poll_interval)
+
+    def _open_demand(self):
+        if self.demand_send is None:
+            self.demand_recv, self.demand_send = socket.socketpair()
+            self.demand_recv.setblocking(False)
+            self.demand_send.setblocking(False)
+
+    def close(self):
+        if self.demand_send is not None:
+            self.demand_send.close()
+            self.demand_recv.close()
+            self.demand_send = self.demand_recv = None
+
+    def demand(self) -> bool:
+        """Whether the writer should write more -> always without a low_watermark"""
+        return self.low_watermark is None or self.size() <= self.low_watermark
+
+    def _signal_demand(self, length):
+        """Called by the reader after reading length frames -> wakes the writer if the read crossed the watermark"""
+        low_watermark = self.low_watermark
+        if low_watermark is None or self.demand_send is None:
+            return
+        size = self.size()
+        if size <= low_watermark < size + length:
+            try:
+                self.demand_send.send(b"\0")
+            except (BlockingIOError, OSError):
+                pass
+
+    def _clear_demand(self):
+        try:
+            while self.demand_recv.recv(64):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _wait_for_demand(self):
+        if self.demand_recv is None:
+            self._wait()
+            return
+        # with a timeout in case the watermark changed without a read
+        select.select([self.demand_recv], [], [], 0.1)
+        self._clear_demand()
+
+    def put(self, data: np.ndarray, length=None, put_incrementally=False) -> int:
+        if length is None:
+            length = np.shape(data)[0]
+
+        if not put_incrementally:
+            if length > self.capacity:
+                raise ValueError("given length is larger than queue capacity")
+
+            while not self.put_nowait(data, length=length):  # we must wait
+                self._wait()
+        else:
+            remaining = length
+            while remaining > 0:
+                # get available space
+                avail = min(self.capacity - self.size(), remaining)
+                if avail == 0:
+                    self._wait()
+                    continue
+
+                # fill the available space
+                self.put_nowait(data[length - remaining:], length=avail)
+                remaining -= avail
+
+        return True
+
+    def put_nowait(self, data: np.ndarray, length=None):
+        if length is None:
+            length = np.shape(data)[0]
+
+        write_idx = self.write_idx
+        if write_idx + length - self.read_idx > self.capacity:
+            return False
+
+        self.buffer.put(write_idx % self.capacity, data, length=length)
+        self.write_idx = write_idx + length  # publish after the copy
+        return True
+
+    def get_into(self, output: np.ndarray, length=None) -> int:
+        if length is None:
+            length = np.shape(output)[0]
+
+        while not self.get_into_nowait(output, length=length):
+            self._wait()
+        return True
+
+    def get_into_nowait(self, output: np.ndarray, length=None) -> int:
+        if length is None:
+            length = np.shape(output)[0]
+
+        read_idx = self.read_idx
+        if read_idx + length > self.write_idx:
+            return False
+
+        self.buffer.get_into(read_idx % self.capacity, output, length=length)
+        self.read_idx = read_idx + length  # publish after the copy
+        self._signal_demand(length)
+        return True
+
+    def get(self, length):
+        output = self.get_nowait(length)
+        while output is None:
+            self._wait()
+            output = self.get_nowait(length)
+        return output
+
+    def write_regions_nowait(self, length):
+        if not self.demand():
+            return None
+        return super().write_regions_nowait(length)
+
+    def write_regions(self, length):
+        """Like write_regions_nowait() but waits for room, or for demand with a low_watermark"""
+        if length > self.capacity:
+            raise ValueError("given length is larger than queue capacity")
+
+        # cleared before checking, so a read in between still wakes us up
+        if self.demand_recv is not None:
+            self._clear_demand()
+        regions = self.write_regions_nowait(length)
+        while regions is None:
+            self._wait_for_demand()
+            regions = self.write_regions_nowait(length)
+        return regions
+
+    def commit_write(self, length):
+        self.write_idx += length  # publish once the regions are written
+
+    def commit_read(self, length):
+        self.read_idx += length  # publish once the regions are read
+        self._signal_demand(length)
+
+    def get_nowait(self, length):
+        read_idx = self.read_idx
+        if read_idx + length > self.write_idx:
+            return None
+
+        _, output = self.buffer.get(read_idx % self.capacity, length)
+        self.read_idx = read_idx + length  # publish after the copy
+        self._signal_demand(length)
+        return output
+
+
+class AnalysisRing(LockFreeQueueBuffer):
+    """
+    Bounded, preallocated ring for handing input audio from a stream callback to an analysis thread
+
+    The real time side copies every block into the ring with write(), so it never keeps references to
+    buffers that the audio driver reuses. If the analysis thread falls behind, new blocks are dropped and
+    counted instead of memory growing without bound. The analysis thread reads chunks with read(), which
+    sleeps until the missing frames should have arrived (given the sample_rate) instead of polling.
+
+    Every drop is logged with the ring index of the gap it leaves, so the reader can account for the
+    dropped frames exactly where they were in the stream: pending_drop() is the oldest drop the reader
+    hasn't passed yet, and take_drop() consumes it once every frame before the gap has been read.
+    """
+
+    def __init__(self, shape: tuple = (0, 0), buffer=None, poll_interval=0.0005, sample_rate=None, log_size=1024):
+        super().__init__(shape, buffer=buffer, poll_interval=poll_interval)
+        self.sample_rate = sample_rate
+        self.overruns = 0
+        self.dropped_frames = 0
+
+        # (ring index of the gap, frames) of each drop -> the writer only moves drops_logged, the reader drops_read
+        self.drop_log = np.zeros((log_size, 2), dtype=np.int64)
+        self.drops_logged = 0
+        self.drops_read = 0
+        self.unlogged_frames = 0  # dropped while the log was full -> given to the reader at the end of the log
+        self.unlogged_read = 0
+
+    def write(self, data: np.ndarray, length=None) -> bool:
+        if length is None:
+            length = np.shape(data)[0]
+
+        if not self.put_nowait(data, length=length):
+            self.overruns += 1
+            self.dropped_frames += length
+            if self.drops_logged - self.drops_read < self.drop_log.shape[0]:
+                self.drop_log[self.drops_logged % self.drop_log.shape[0]] = (self.write_idx, length)
+                self.drops_logged += 1  # publish after the entry is written
+            else:
+                self.unlogged_frames += length
+            return False
+        return True
+
+    def pending_drop(self):
+        """(ring index of the gap, frames) of the oldest drop the reader hasn't taken yet, or None"""
+        if self.drops_read < self.drops_logged:
+            idx, frames = self.drop_log[self.drops_read % self.drop_log.shape[0]]
+            return int(idx), int(frames)
+        unlogged = self.unlogged_frames - self.unlogged_read
+        if unlogged > 0:
+            return self.read_idx, unlogged
+        return None
+
+    def take_drop(self) -> int:
+        """Consume the oldest pending drop. Returns its frames"""
+        if self.drops_read < self.drops_logged:
+            frames = int(self.drop_log[self.drops_read % self.drop_log.shape[0], 1])
+            self.drops_read += 1
+            return frames
+        frames = self.unlogged_frames - self.unlogged_read
+        self.unlogged_read += frames
+        return frames
+
+    def read(self, output: np.ndarray, length=None, timeout=None) -> bool:
+        """Wait for length frames and copy them into output. Returns False if the timeout (seconds) ran out"""
+        if length is None:
+            length = np.shape(output)[0]
+
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while not self.get_into_nowait(output, length=length):
+            sleep = self.poll_interval
+            if self.sample_rate is not None:
+                sleep = max(sleep, (length - self.size()) / self.sample_rate)
+            if deadline is not None:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return False
+                sleep = min(sleep, remaining)
+            time.sleep(sleep)
+        return True
+
+
+class JitterBuffer(LockFreeQueueBuffer):
+    """
+    LockFreeQueueBuffer that adapts how much audio it keeps queued to what the host can sustain
+
+    target is the number of frames that should be queued when the reader takes a block. The reader
+    records the fill level of every read, and every `window` reads the target is adapted: it grows by a
+    block after any underflow, and otherwise shrinks by at most `step` towards the lowest fill that still
+    leaves room for the measured jitter. It never goes over max_target, the latency ceiling.
+
+    With correct_drift the writer runs on its own clock (like an input stream feeding an output stream),
+    so the reader pulls the fill level towards the target: block_size reads are linearly resampled from
+    block_size + adjust (dropping adjust frames) or block_size - adjust frames (inserting them). Without it
+    the writer is pull driven: the low watermark follows the target, so write_regions() waits until
+    there is room for a block below the target.
+    Only get_into_nowait() corrects drift, read_regions_nowait() just records the fill level.
+    """
+
+    def __init__(self, shape: tuple = (0, 0), block_size=1024, target=None, min_target=None, max_target=None,
+                 correct_drift=False, window=64, step=None, adjust=None, poll_interval=0.0005):
+        self.block_size = block_size
+        self.min_target = block_size if min_target is None else min_target
+        self.max_target = max(self.min_target, shape[0] - block_size if max_target is None else max_target)
+        self.target = min(max(2 * block_size if target is None else target, self.min_target), self.max_target)
+        self.correct_drift = correct_drift
+        self.window = window
+        self.step = max(1, block_size // 8) if step is None else step
+        self.adjust = max(1, block_size // 64) if adjust is None else adjust
+
+        # room for the ceiling plus a block being written and the drift correction
+        capacity = max(shape[0], self.max_target + block_size + self.adjust)
+        capacity += capacity % 2
+        super().__init__((capacity,) + tuple(shape[1:]), poll_interval=poll_interval)
+        self._update_watermark()
+
+        self.underflows = 0
+        self.overflows = 0
+        self.dropped_frames = 0
+        self.inserted_frames = 0
+
+        # fill level stats of the current window -> plain numbers so recording never allocates
+        self.hold = 0  # windows to wait after growing before shrinking again
+        self._reset_window()
+
+        # linear resampling of block_size + adjust and block_size - adjust frames into block_size frames
+        channels = shape[1:]
+        self.scratch = np.zeros((block_size + self.adjust,) + tuple(channels), dtype=np.float32)
+        self.lower = np.zeros((block_size,) + tuple(channels), dtype=np.float32)
+        self.upper = np.zeros((block_size,) + tuple(channels), dtype=np.float32)
+        self.resamplers = {length: self._make_resampler(length) for length in
+                           (block_size + self.adjust, block_size - self.adjust)}
+
+    def _make_resampler(self, length):
+        positions = np.linspace(0, length - 1, self.block_size)
+        idx = np.minimum(np.floor(positions).astype(np.intp), length - 2)
+        frac = (positions - idx).astype(np.float32).reshape((-1,) + (1,) * (self.scratch.ndim - 1))
+        return idx, idx + 1, frac
+
+    def _reset_window(self):
+        self.window_reads = 0
+        self.window_underflows = 0
+        self.fill_sum = 0.0
+        self.fill_sq = 0.0
+        self.fill_min = self.capacity
+
+    def _record(self, fill, length, underflow):
+        """Called by the reader for every read -> adapts the target once per window"""
+        self.window_reads += 1
+        self.fill_sum += fill
+        self.fill_sq += fill * fill
+        self.fill_min = min(self.fill_min, fill)
+        if underflow:
+            self.underflows += 1
+            self.window_underflows += 1
+
+        if self.window_reads >= self.window:
+            self._adapt(length)
+            self._reset_window()
+
+    def _adapt(self, length):
+        n = self.window_reads
+        mean = self.fill_sum / n
+        std = max(0.0, self.fill_sq / n - mean * mean) ** 0.5
+
+        if self.window_underflows > 0:
+            self.target = min(self.target + self.block_size, self.max_target)
+            self.hold = 8
+        elif self.hold > 0:
+            self.hold -= 1
+        else:
+            # the lowest fill was never needed beyond one read -> give the spare back, keeping a margin for jitter
+            spare = self.fill_min - length - int(2 * std)
+            if spare > 0:
+                self.target = max(self.min_target, self.target - min(spare, self.step))
+        self._update_watermark()
+
+    def _update_watermark(self):
+        if not self.correct_drift:
+            self.low_watermark = max(0, self.target - self.block_size)
+            self._open_demand()
+
+    def put_nowait(self, data: np.ndarray, length=None):
+        if not super().put_nowait(data, length=length):
+            self.overflows += 1
+            return False
+        return True
+
+    def get_into_nowait(self, output: np.ndarray, length=None) -> int:
+        if length is None:
+            length = np.shape(output)[0]
+
+        fill = self.size()
+        if self.correct_drift and length == self.block_size:
+            # way over the ceiling (the reader stalled) -> jump back to the target at once
+            if fill > self.max_target + length:
+                self.dropped_frames += fill - self.target
+                self.read_idx = self.write_idx - self.target
+                fill = self.target
+
+            excess = fill - self.target
+            if excess > self.adjust and fill >= length + self.adjust:
+                self._read_resampled(output, length + self.adjust)
+                self.dropped_frames += self.adjust
+                self._record(fill, length, False)
+                return True
+            if excess < -self.adjust and fill >= length - self.adjust:
+                self._read_resampled(output, length - self.adjust)
+                self.inserted_frames += self.adjust
+                self._record(fill, length, False)
+                return True
+
+        read = super().get_into_nowait(output, length=length)
+        self._record(fill, length, not read)
+        return read
+
+    def _read_resampled(self, output: np.ndarray, length):
+        idx, idx_next, frac = self.resamplers[length]
+        super().get_into_nowait(self.scratch, length=length)
+        np.take(self.scratch, idx, axis=0, out=self.lower)
+        np.take(self.scratch, idx_next, axis=0, out=self.upper)
+        self.upper -= self.lower
+        self.upper *= frac
+        np.add(self.lower, self.upper, out=output[:self.block_size])
+
+    def read_regions_nowait(self, length):
+        regions = super().read_regions_nowait(length)
+        self._record(self.size(), length, regions is None)
+        return regions
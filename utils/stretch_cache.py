@@ -0,0 +1,143 @@
+import numpy as np
+from collections import OrderedDict
+from queue import Queue
+from threading import Thread, Lock
+from utils.stretcher import create_stretcher
+
+
+def render_stretched(audio: np.ndarray, sample_rate, ratio, stretcher="auto", preroll=4096, block_size=1024):
+    """
+    Stretch one cycle of the looping audio by ratio (output length / input length).
+
+    The stretcher starts preroll frames before the start of the loop and runs on past its end,
+    so the result has no fade in or tail and loops around as seamlessly as the live stretcher.
+    """
+    samples = audio.shape[0]
+    frames = int(round(samples * ratio))
+    stretcher = create_stretcher(stretcher, sample_rate=sample_rate, channels=audio.shape[1])
+    stretcher.set_time_ratio(ratio)
+
+    # output that comes from the preroll or the stretcher's startup delay
+    discard = int(round(preroll * ratio)) + int(stretcher.get_latency())
+
+    output = np.zeros((frames, audio.shape[1]), dtype=np.float32)
+    filled = 0
+    position = -preroll
+    while filled < frames:
+        stretcher.process(np.take(audio, np.arange(position, position + block_size), axis=0, mode="wrap"), False)
+        position += block_size
+
+        stretched = stretcher.retrieve()
+        while stretched.shape[0] > 0:
+            skipped = min(discard, stretched.shape[0])
+            discard -= skipped
+            num_frames = min(stretched.shape[0] - skipped, frames - filled)
+            output[filled:filled + num_frames] = stretched[skipped:skipped + num_frames]
+            filled += num_frames
+            stretched = stretcher.retrieve()
+
+    return output
+
+
+class StretchCache(object):
+    """
+    In memory cache of an AudioLoop pre rendered at quantized time ratios
+
+    Ratios are rounded to multiples of step and each one is rendered once in a background thread
+    (or right away without background). get() never waits: it returns None and queues the render
+    when a ratio isn't ready yet. The least recently used renders are dropped once they take
+    more than max_bytes.
+
+    covers() limits which ratios are worth rendering: the ones within max_span of the tempo ratio,
+    and only as many around it as fit in max_bytes at once, so beat corrections don't thrash the cache.
+    """
+
+    def __init__(self, loop, stretcher="auto", step=0.005, max_bytes=64 * 2 ** 20, preroll=4096, background=True,
+                 max_span=0.05):
+        self.audio = loop.audio
+        self.sample_rate = loop.sample_rate
+        self.stretcher = stretcher
+        self.step = step
+        self.max_span = max_span
+        self.max_bytes = max_bytes
+        self.preroll = preroll
+        self.background = background
+
+        self.rendered = OrderedDict()
+        self.bytes = 0
+        self.lock = Lock()
+
+        self.pending = set()
+        self.requests = Queue()
+        self.thread = None
+
+    def get_key(self, ratio) -> int:
+        return int(round(ratio / self.step))
+
+    def get_ratio(self, key) -> float:
+        return key * self.step
+
+    def covers(self, ratio, tempo_ratio) -> bool:
+        """Whether ratio is close enough to tempo_ratio to be served from (and rendered into) the cache"""
+        render_bytes = self.audio.shape[0] * tempo_ratio * self.audio.shape[1] * self.audio.itemsize
+        span = min(int(self.max_bytes // render_bytes), int(2 * self.max_span / self.step) + 1)
+        return abs(self.get_key(ratio) - self.get_key(tempo_ratio)) <= (span - 1) // 2
+
+    def get(self, ratio):
+        """The loop rendered at the nearest quantized ratio, or None (and queue it) if it isn't ready"""
+        key = self.get_key(ratio)
+        with self.lock:
+            rendered = self.rendered.get(key)
+            if rendered is not None:
+                self.rendered.move_to_end(key)
+                return rendered
+
+        self.request(key)
+        return None
+
+    def prefetch(self, ratios):
+        for ratio in ratios:
+            self.request(self.get_key(ratio))
+
+    def request(self, key):
+        with self.lock:
+            if key in self.rendered or key in self.pending:
+                return
+            self.pending.add(key)
+
+        if not self.background:
+            self._render(key)
+            return
+
+        if self.thread is None:
+            self.thread = Thread(target=self._render_thread, daemon=True)
+            self.thread.start()
+        self.requests.put(key)
+
+    def close(self):
+        if self.thread is not None:
+            self.requests.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def _render_thread(self):
+        """THREAD: renders the requested ratios one at a time"""
+        while True:
+            key = self.requests.get()
+            if key is None:
+                break
+            self._render(key)
+
+    def _render(self, key):
+        rendered = render_stretched(self.audio, self.sample_rate, self.get_ratio(key), stretcher=self.stretcher,
+                                    preroll=self.preroll)
+
+        with self.lock:
+            self.pending.discard(key)
+            self.rendered[key] = rendered
+            self.bytes += rendered.nbytes
+
+            # evict the least recently used, but always keep the newest
+            while self.bytes > self.max_bytes and len(self.rendered) > 1:
+                _, evicted = self.rendered.popitem(last=False)
+                self.bytes -= evicted.nbytes
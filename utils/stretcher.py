@@ -0,0 +1,272 @@
+import numpy as np
+from functools import lru_cache
+from importlib import import_module
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+# names accepted by create_stretcher() -> auto is rubberband if it is built, else wsola
+STRETCHERS = ("auto", "rubberband", "wsola")
+
+
+@lru_cache(maxsize=None)
+def _rubberband_built() -> bool:
+    try:
+        import_module("lib.rubberband")
+    except ImportError:
+        print("rubberband is not built, falling back to the wsola stretcher")
+        return False
+    return True
+
+
+def resolve_stretcher(name="auto") -> str:
+    """The backend name create_stretcher() will use -> whether rubberband is built is only checked once"""
+    if name not in STRETCHERS:
+        raise ValueError(f"unknown stretcher {name}, expected one of {STRETCHERS}")
+    if name != "auto":
+        return name
+    return "rubberband" if _rubberband_built() else "wsola"
+
+
+def create_stretcher(name="auto", sample_rate=44100, channels=2):
+    """
+    Create a real time time stretcher by backend name.
+
+    Every backend has the interface of lib.rubberband.AudioStretcher:
+    set_time_ratio(), process(block, final), available(), retrieve(), get_latency() and reset(),
+    plus retrieve_into(output), which copies stretched audio into a given array.
+    """
+    if resolve_stretcher(name) == "rubberband":
+        return RubberbandStretcher(sample_rate=sample_rate, channels=channels)
+    return WsolaStretcher(sample_rate=sample_rate, channels=channels)
+
+
+class RubberbandStretcher(object):
+    """
+    The native rubberband AudioStretcher plus retrieve_into()
+
+    The native retrieve() returns everything available, so whatever doesn't fit into the
+    retrieve_into() output is kept and copied out first next time.
+    """
+
+    def __init__(self, sample_rate=44100, channels=2):
+        # only import the native wrapper when it's used -> it isn't built everywhere
+        from lib.rubberband import AudioStretcher  # pylint: disable=import-error,no-name-in-module
+
+        self.stretcher = AudioStretcher(sample_rate=sample_rate, channels=channels, realtime=True)
+        self.pending = np.zeros((0, channels), dtype=np.float32)
+        self.pending_idx = 0
+
+    def set_time_ratio(self, ratio):
+        self.stretcher.set_time_ratio(ratio)
+
+    def process(self, block: np.ndarray, final=False):
+        self.stretcher.process(block, final)
+
+    def get_latency(self) -> int:
+        return self.stretcher.get_latency()
+
+    def reset(self):
+        """Drop all input and output, as if just created (keeps the time ratio)"""
+        self.stretcher.reset()
+        self.pending_idx = self.pending.shape[0]
+
+    def available(self) -> int:
+        return self.pending.shape[0] - self.pending_idx + self.stretcher.available()
+
+    def retrieve(self) -> np.ndarray:
+        if self.pending_idx < self.pending.shape[0]:
+            output = self.pending[self.pending_idx:]
+            self.pending_idx = self.pending.shape[0]
+            return output
+        return self.stretcher.retrieve()
+
+    def retrieve_into(self, output: np.ndarray) -> int:
+        """Copy as much stretched audio as fits into output. Returns the number of frames"""
+        filled = 0
+        while filled < output.shape[0]:
+            if self.pending_idx == self.pending.shape[0]:
+                self.pending = self.stretcher.retrieve()
+                self.pending_idx = 0
+                if self.pending.shape[0] == 0:
+                    break
+
+            num_frames = min(output.shape[0] - filled, self.pending.shape[0] - self.pending_idx)
+            output[filled:filled + num_frames] = self.pending[self.pending_idx:self.pending_idx + num_frames]
+            self.pending_idx += num_frames
+            filled += num_frames
+        return filled
+
+
+class WsolaStretcher(object):
+    """
+    Pure NumPy real time time stretcher using WSOLA (waveform similarity overlap add)
+
+    Hann windowed frames are overlap added every synthesis hop (half a frame) while the input is read
+    every synthesis hop / time ratio. Each frame is shifted by up to tolerance samples to the position
+    most similar to where the previous frame would naturally continue, which keeps the waveform
+    continuous and the pitch unchanged. Good on drums and transients, worse than rubberband on tonal audio.
+
+    time_ratio is output length / input length, like rubberband. The buffers grow if needed but are
+    otherwise reused, and process() can be called with blocks of any size.
+    """
+
+    def __init__(self, sample_rate=44100, channels=2, frame_size=None, tolerance=None):
+        if frame_size is None:
+            # about 20 ms -> 1024 at 44.1/48 kHz
+            frame_size = int(2 ** round(np.log2(sample_rate * 0.02)))
+        if tolerance is None:
+            tolerance = frame_size // 4
+
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frame_size = frame_size
+        self.hop = frame_size // 2
+        self.tolerance = tolerance
+        self.time_ratio = 1.0
+
+        # periodic hann windows at half a frame overlap sum to exactly 1
+        self.window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(frame_size) / frame_size)).astype(np.float32)
+        self.window = self.window[:, np.newaxis]
+
+        # input not used yet -> starts with tolerance samples of silence so the first frames can be shifted
+        self.input = np.zeros((4 * frame_size, channels), dtype=np.float32)
+        self.input_len = tolerance
+        self.position = float(tolerance)  # where the next frame would start without shifting
+        self.natural = None  # where the last frame continues, None before the first frame
+
+        self.frame = np.zeros((frame_size, channels), dtype=np.float32)
+        self.overlap = np.zeros((frame_size, channels), dtype=np.float32)
+
+        # stretched audio waiting to be retrieved is output[output_start:output_len]
+        self.output = np.zeros((4 * frame_size, channels), dtype=np.float32)
+        self.output_start = 0
+        self.output_len = 0
+        self.empty = np.zeros((0, channels), dtype=np.float32)
+
+    def set_time_ratio(self, ratio):
+        self.time_ratio = ratio
+
+    def reset(self):
+        """Drop all input and output, as if just created (keeps the time ratio and the buffers)"""
+        self.input[:self.tolerance] = 0
+        self.input_len = self.tolerance
+        self.position = float(self.tolerance)
+        self.natural = None
+        self.overlap[:] = 0
+        self.output_start = self.output_len = 0
+
+    def get_latency(self) -> int:
+        """Input samples given to process() that aren't in the retrieved or available output yet"""
+        start = self.tolerance if self.natural is None else self.natural
+        return max(0, self.input_len - start)
+
+    def available(self) -> int:
+        return self.output_len - self.output_start
+
+    def retrieve(self) -> np.ndarray:
+        """All of the available stretched audio (frames, channels)"""
+        if self.available() == 0:
+            return self.empty
+        output = self.output[self.output_start:self.output_len].copy()
+        self.output_start = self.output_len = 0
+        return output
+
+    def retrieve_into(self, output: np.ndarray) -> int:
+        """Copy as much stretched audio as fits into output. Returns the number of frames"""
+        num_frames = min(output.shape[0], self.available())
+        output[:num_frames] = self.output[self.output_start:self.output_start + num_frames]
+        self.output_start += num_frames
+        if self.output_start == self.output_len:
+            self.output_start = self.output_len = 0
+        return num_frames
+
+    def process(self, block: np.ndarray, final=False):
+        if block.ndim == 1:
+            block = block[:, np.newaxis]
+        self._append_input(block)
+        if final:
+            # pad so every real input sample gets into a frame
+            self._append_input(np.zeros((self.frame_size + self.tolerance, self.channels), dtype=np.float32))
+
+        self._process_frames()
+
+        if final:
+            # the second half of the last frame
+            self._append_output(self.overlap[:self.frame_size - self.hop])
+            self.overlap[:] = 0
+
+    def _append_input(self, block: np.ndarray):
+        frames = block.shape[0]
+        if self.input_len + frames > self.input.shape[0]:
+            self.input = _grow(self.input, self.input_len + frames)
+        self.input[self.input_len:self.input_len + frames] = block
+        self.input_len += frames
+
+    def _append_output(self, block: np.ndarray):
+        frames = block.shape[0]
+        if self.output_len + frames > self.output.shape[0] and self.output_start > 0:
+            # move the audio that's left to the front
+            remaining = self.output_len - self.output_start
+            self.output[:remaining] = self.output[self.output_start:self.output_len]
+            self.output_start, self.output_len = 0, remaining
+        if self.output_len + frames > self.output.shape[0]:
+            self.output = _grow(self.output, self.output_len + frames, self.output_len)
+        self.output[self.output_len:self.output_len + frames] = block
+        self.output_len += frames
+
+    def _process_frames(self):
+        frame_size, hop, tolerance = self.frame_size, self.hop, self.tolerance
+
+        while True:
+            nominal = int(round(self.position))
+            if nominal + tolerance + frame_size > self.input_len:
+                break
+
+            start = nominal if self.natural is None else nominal + self._best_shift(nominal)
+
+            # overlap add the windowed frame and output the first hop, which is now complete
+            np.multiply(self.input[start:start + frame_size], self.window, out=self.frame)
+            self.overlap += self.frame
+            self._append_output(self.overlap[:hop])
+            self.overlap[:frame_size - hop] = self.overlap[hop:]
+            self.overlap[frame_size - hop:] = 0
+
+            self.natural = start + hop
+            self.position += hop / self.time_ratio
+
+        # drop the input that no frame can use anymore
+        consumed = int(self.position) - tolerance
+        if self.natural is not None:
+            consumed = min(consumed, self.natural)
+        if consumed > 0:
+            remaining = self.input_len - consumed
+            self.input[:remaining] = self.input[consumed:self.input_len]
+            self.input_len = remaining
+            self.position -= consumed
+            if self.natural is not None:
+                self.natural -= consumed
+
+    def _best_shift(self, nominal) -> int:
+        """Shift from -tolerance to tolerance whose overlap best matches the natural continuation of the last frame"""
+        length = self.frame_size - self.hop
+        tolerance = self.tolerance
+
+        template = self.input[self.natural:self.natural + length].sum(axis=1)
+        region = self.input[nominal - tolerance:nominal + tolerance + length].sum(axis=1)
+        candidates = sliding_window_view(region, length)
+
+        # normalized cross correlation, so loud candidates don't always win
+        correlation = candidates @ template
+        energy = np.cumsum(np.square(region, dtype=np.float64))
+        energy = energy[length - 1:] - np.concatenate(([0.0], energy[:-length]))
+        score = correlation / np.sqrt(np.maximum(energy, 1e-12))
+        return int(np.argmax(score)) - tolerance
+
+
+def _grow(array: np.ndarray, length, keep=None) -> np.ndarray:
+    """Reallocate array to hold at least length frames (keeping the first keep frames)"""
+    if keep is None:
+        keep = array.shape[0]
+    grown = np.zeros((max(length, 2 * array.shape[0]),) + array.shape[1:], dtype=array.dtype)
+    grown[:keep] = array[:keep]
+    return grown